@@ -0,0 +1,317 @@
+"""
+Reproducible benchmarks of featurization, training, classification, classifier files and shape filters, run on
+synthetic strokes (lines, circles, rectangles, triangles and diamonds, with noise and a variable number of points).
+The results are written as JSON, so runs of different releases can be compared with --baseline.
+
+Usage: python bench.py [--points 16,64,256,1024] [--examples 10,100,1000] [--repeat 5] [--seed 0]
+                       [--output bench.json] [--baseline old.json]
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import fv
+import sc
+import geometry
+import shapes
+
+SHAPES = ("line", "circle", "rectangle", "triangle", "diamond")
+POINTS = (16, 64, 256, 1024)
+EXAMPLES = (10, 100, 1000)
+REPEAT = 5
+# Every repeat runs the benchmarked call often enough to take at least MIN_TIME seconds
+MIN_TIME = 0.02
+# Noise of the synthetic strokes, as a fraction of their size
+NOISE = 0.01
+# Size of the synthetic shapes, and of the smaller synthetic gestures the classifier is trained on
+SHAPE_SIZE = 200.0
+GESTURE_SIZE = 50.0
+# Number of shapes classified at once by shapes.classify_batch
+BATCH_SHAPES = 100
+
+
+def polyline(vertices, npoints):
+    """
+    Place points evenly along a polyline.
+    :param vertices: array of the polyline vertices [(xi, yi)]
+    :param npoints: number of points
+    :return: (npoints, 2) array of points
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    lengths = np.hypot(np.diff(vertices[:, 0]), np.diff(vertices[:, 1]))
+    arc = np.concatenate(([0.0], np.cumsum(lengths)))
+    s = np.linspace(0.0, arc[-1], npoints)
+    return np.column_stack((np.interp(s, arc, vertices[:, 0]), np.interp(s, arc, vertices[:, 1])))
+
+
+def shape_strokes(kind, npoints, noise=NOISE, rng=None, size=SHAPE_SIZE, dt=10.0):
+    """
+    Generate a synthetic hand drawn shape. Lines and circles are drawn in one stroke, polygons with one stroke per
+    side, like in recognizer_tkinter. The size, aspect, rotation and drawing speed are varied at random.
+    :param kind: one of SHAPES
+    :param npoints: total number of points of the shape
+    :param noise: standard deviation of the noise added to every coordinate, as a fraction of the size
+    :param rng: numpy random Generator
+    :param size: mean size of the shape
+    :param dt: mean time between two points
+    :return: list of strokes, every stroke an (n, 3) array of (x, y, time) points
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    size = size * rng.uniform(0.75, 1.25)
+    aspect = rng.uniform(0.8, 1.25)
+    if kind == "line":
+        sides = [np.array([(0.0, 0.0), (1.0, 0.0)])]
+    elif kind == "circle":
+        a = np.linspace(0.0, 2 * math.pi, max(npoints, 2))
+        sides = [0.5 * np.column_stack((np.cos(a), np.sin(a)))]
+    elif kind == "rectangle":
+        corners = np.array([(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0), (0.0, 0.0)])
+        sides = [corners[i:i + 2] for i in range(4)]
+    elif kind == "triangle":
+        corners = np.array([(0.0, 0.0), (1.0, 0.0), (0.5, 1.0), (0.0, 0.0)])
+        sides = [corners[i:i + 2] for i in range(3)]
+    elif kind == "diamond":
+        corners = np.array([(0.5, 0.0), (1.0, 0.5), (0.5, 1.0), (0.0, 0.5), (0.5, 0.0)])
+        sides = [corners[i:i + 2] for i in range(4)]
+    else:
+        raise Exception("shape_strokes: unknown shape {0}".format(kind))
+
+    angle = rng.uniform(-0.1, 0.1) if kind != "line" else rng.uniform(0.0, 2 * math.pi)
+    rotation = np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+    counts = np.full(len(sides), max(npoints // len(sides), 2))
+    counts[-1] += max(npoints - counts.sum(), 0)
+    strokes = []
+    t = 0.0
+    for side, n in zip(sides, counts):
+        xy = side if len(side) == n else polyline(side, n)
+        xy = (xy * (size, size * aspect)) @ rotation.T + rng.normal(0.0, noise * size, (n, 2))
+        times = t + np.cumsum(rng.uniform(0.5, 1.5, n) * dt)
+        t = times[-1] + 5 * dt
+        strokes.append(np.column_stack((np.round(xy + 300.0), times)))
+    return strokes
+
+
+def shape_points(kind, npoints, noise=NOISE, rng=None, size=GESTURE_SIZE):
+    """
+    Generate a synthetic gesture: a shape with all its strokes joined.
+    :return: (npoints, 3) array of (x, y, time) points
+    """
+    return np.concatenate(shape_strokes(kind, npoints, noise, rng, size))
+
+
+def measure(fn, repeat=REPEAT, setup=None, min_time=MIN_TIME):
+    """
+    Time a call. Without setup the call is repeated until it takes at least min_time seconds, with setup every
+    call gets its own fresh arguments and is timed on its own.
+    :param fn: function to time
+    :param repeat: number of timings to take
+    :param setup: function returning the arguments of fn, called outside the timing
+    :param min_time: smallest duration of a timing without setup
+    :return: dict with the min, median and mean duration of one call in seconds, and the number of calls per timing
+    """
+    number = 1
+    if setup is None:
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            if time.perf_counter() - start >= min_time or number >= 1 << 20:
+                break
+            number *= 2
+    timings = []
+    for _ in range(repeat):
+        if setup is None:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            timings.append((time.perf_counter() - start) / number)
+        else:
+            args = setup()
+            start = time.perf_counter()
+            fn(*args)
+            timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": float(np.median(timings)), "mean": float(np.mean(timings)),
+            "number": number}
+
+
+def per_item(timing, n):
+    """
+    :param timing: timing of a call processing n items, as returned by measure
+    :param n: number of items
+    :return: the timing of one item
+    """
+    return dict(timing, min=timing["min"] / n, median=timing["median"] / n, mean=timing["mean"] / n)
+
+
+def features(points):
+    """
+    :param points: sequence of (x, y, time) points
+    :return: fv.FV with all points added
+    """
+    feature_vector = fv.FV()
+    for p in points:
+        feature_vector.AddPoint(p[0], p[1], p[2])
+    return feature_vector
+
+
+def train(examples):
+    """
+    :param examples: list of (class name, feature vector)
+    :return: trained sClassifier
+    """
+    classifier = sc.sClassifier()
+    for classname, y in examples:
+        classifier.sAddExample(classname, y)
+    classifier.sDoneAdding()
+    return classifier
+
+
+def bench_features(points, repeat, rng):
+    """
+    Time featurizing a gesture point by point, and calculating its feature vector, for every number of points.
+    :return: list of (name, number of points, timing)
+    """
+    results = []
+    for n in points:
+        gesture = shape_points("circle", n, rng=rng)
+        filled = features(gesture)
+        results.append(("fv.AddPoint", n, measure(lambda: features(gesture), repeat)))
+        results.append(("fv.FvCalc", n, measure(filled.FvCalc, repeat)))
+    return results
+
+
+def bench_classifier(examples, repeat, rng):
+    """
+    Time training on every number of examples per class of every shape (sAddExample times adding all examples),
+    classifying one gesture, and writing and reading the trained classifier.
+    :return: list of (name, number of examples per class, timing)
+    """
+    results = []
+    for n in examples:
+        data = [(kind, features(shape_points(kind, 64, rng=rng)).FvCalc()) for i in range(n) for kind in SHAPES]
+        classifier = train(data)
+        y = data[0][1]
+
+        def add_examples():
+            c = sc.sClassifier()
+            for classname, example in data:
+                c.sAddExample(classname, example)
+
+        def untrained():
+            c = sc.sClassifier()
+            for classname, example in data:
+                c.sAddExample(classname, example)
+            return (c,)
+
+        results.append(("sc.sAddExample", n, measure(add_examples, repeat)))
+        results.append(("sc.sDoneAdding", n, measure(lambda c: c.sDoneAdding(), repeat, setup=untrained)))
+        results.append(("sc.sClassifyAD", n, measure(lambda: classifier.sClassifyAD(y), repeat)))
+
+        with tempfile.TemporaryDirectory() as directory:
+            binary = os.path.join(directory, "classifier.bin")
+            text = os.path.join(directory, "classifier.txt")
+            results.append(("sc.write", n, measure(lambda: classifier.write(binary), repeat)))
+            results.append(("sc.writeText", n, measure(lambda: classifier.writeText(text), repeat)))
+            # read reports the classes it reads on standard output
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results.append(("sc.read", n, measure(lambda: sc.sClassifier().read(binary), repeat)))
+                results.append(("sc.read text", n, measure(lambda: sc.sClassifier().read(text), repeat)))
+    return results
+
+
+def bench_shapes(points, repeat, rng):
+    """
+    Time the shape filters on a diamond of every number of points.
+    :return: list of (name, number of points, timing)
+    """
+    results = []
+    for n in points:
+        strokes = shape_strokes("diamond", n, rng=rng)
+        g = geometry.GestureGeometry()
+        for stroke in strokes:
+            g.add_stroke(stroke)
+        hull = g.hull
+        results.append(("shapes.calc_area", n, measure(lambda: shapes.calc_area(np.concatenate(strokes)), repeat)))
+        results.append(("shapes.area_ratio_filter", n,
+                        measure(lambda: shapes.area_ratio_filter(hull[:, 0], hull[:, 1], g.area), repeat)))
+        results.append(("shapes.area_perimeter_ratio", n,
+                        measure(lambda: shapes.area_perimeter_ratio(g.area, g.hull_perimeter, g.bbox), repeat)))
+        results.append(("shapes.triangle_diamond_filter", n,
+                        measure(lambda: shapes.triangle_diamond_filter(strokes), repeat)))
+        results.append(("shapes.classify_gesture", n,
+                         measure(lambda gesture: shapes.classify_gesture(gesture), repeat,
+                                 setup=lambda: (shapes.Gesture(g, strokes),))))
+        # A batch of BATCH_SHAPES shapes of every kind, timed per shape
+        batch = [shape_strokes(SHAPES[i % len(SHAPES)], n, rng=rng) for i in range(BATCH_SHAPES)]
+        xy = np.concatenate([p for s in batch for p in s])
+        offsets = np.cumsum([0] + [sum(len(p) for p in s) for s in batch])
+        stroke_offsets = np.cumsum([0] + [len(p) for s in batch for p in s])
+        timing = measure(lambda: shapes.classify_batch(xy[:, 0], xy[:, 1], offsets, stroke_offsets), repeat)
+        results.append(("shapes.classify_batch", n, per_item(timing, BATCH_SHAPES)))
+    return results
+
+
+def run(points=POINTS, examples=EXAMPLES, repeat=REPEAT, seed=0):
+    """
+    Run all benchmarks.
+    :param points: numbers of points per gesture to benchmark featurization and shape filters with
+    :param examples: numbers of training examples per class to benchmark the classifier with
+    :param repeat: number of timings of every benchmark
+    :param seed: seed of the synthetic data
+    :return: dict with the environment and a list of results, durations in seconds per call
+    """
+    rng = np.random.default_rng(seed)
+    results = bench_features(points, repeat, rng) + bench_classifier(examples, repeat, rng) + \
+        bench_shapes(points, repeat, rng)
+    return {"environment": {"python": sys.version.split()[0], "numpy": np.__version__,
+                            "platform": platform.platform(), "machine": platform.machine(),
+                            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": seed, "repeat": repeat},
+            "results": [dict(name=name, size=size, **timing) for name, size, timing in results]}
+
+
+def compare(baseline, report):
+    """
+    Ratio of the median durations of a report to those of a baseline report, for every benchmark in both.
+    :return: list of (name, size, ratio), a ratio above 1 being a slowdown
+    """
+    old = {(r["name"], r["size"]): r["median"] for r in baseline["results"]}
+    return [(r["name"], r["size"], r["median"] / old[(r["name"], r["size"])])
+            for r in report["results"] if old.get((r["name"], r["size"]))]
+
+
+def sizes(value):
+    return tuple(int(v) for v in value.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark featurization, classification and shape filters")
+    parser.add_argument("--points", type=sizes, default=POINTS, help="comma separated numbers of points")
+    parser.add_argument("--examples", type=sizes, default=EXAMPLES, help="comma separated numbers of examples")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write, standard output if not given")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = run(args.points, args.examples, args.repeat, args.seed)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        for name, size, ratio in compare(baseline, report):
+            print("{0:32} {1:>6} {2:6.2f}x".format(name, size, ratio), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
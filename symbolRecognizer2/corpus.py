@@ -0,0 +1,285 @@
+"""
+Columnar on-disk gesture store, readable through numpy.memmap so datasets larger than memory can be streamed.
+
+A store is a directory holding:
+    header.json          format version, dtypes and counts
+    x.bin, y.bin         concatenated coordinates of all points (int32 by default, or float32)
+    t.bin                concatenated time values (float32), relative to the first point of their gesture
+    strokes.bin          int64 index of the first point of every stroke, followed by the number of points
+    gestures.bin         int64 index of the first stroke of every gesture, followed by the number of strokes
+    labels.bin           int32 index in labels.txt of the label of every gesture
+    labels.txt           label names, one per line
+
+Usage: python corpus.py <corpus directory> <store directory>
+    converts a corpus directory as read by train.py (one subdirectory per class, one gesture file per gesture)
+"""
+import json
+import os
+import sys
+import numpy as np
+import fv
+import shapes
+
+STORE_VERSION = 1
+TIME_DTYPE = "<f4"
+OFFSET_DTYPE = "<i8"
+LABEL_DTYPE = "<i4"
+BATCH_SIZE = 4096
+
+
+class GestureStoreWriter:
+    """
+    Append gestures to a new store, streaming every column to its file.
+    """
+
+    def __init__(self, directory, coord_dtype="<i4"):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.coord_dtype = np.dtype(coord_dtype)
+        self.files = {name: open(os.path.join(directory, name + ".bin"), "wb")
+                      for name in ("x", "y", "t", "strokes", "gestures", "labels")}
+        self.label_names = []
+        self.label_index = {}
+        self.npoints = 0
+        self.nstrokes = 0
+        self.ngestures = 0
+
+    def add_gesture(self, label, strokes):
+        """
+        Append a gesture.
+        :param label: label of the gesture
+        :param strokes: list of strokes, every stroke a sequence of (x, y, time) or (x, y) points
+        :return: index of the gesture in the store
+        """
+        if label not in self.label_index:
+            self.label_index[label] = len(self.label_names)
+            self.label_names.append(label)
+
+        self.files["gestures"].write(np.array([self.nstrokes], dtype=OFFSET_DTYPE).tobytes())
+        self.files["labels"].write(np.array([self.label_index[label]], dtype=LABEL_DTYPE).tobytes())
+        start = None
+        for stroke in strokes:
+            points = np.asarray(stroke, dtype=np.float64).reshape(len(stroke), -1)
+            t = points[:, 2] if points.shape[1] > 2 else np.zeros(len(points))
+            if start is None and len(points):
+                start = t[0]
+            self.files["strokes"].write(np.array([self.npoints], dtype=OFFSET_DTYPE).tobytes())
+            self.files["x"].write(self.coordinates(points[:, 0]).tobytes())
+            self.files["y"].write(self.coordinates(points[:, 1]).tobytes())
+            self.files["t"].write((t - (start if start is not None else 0.0)).astype(TIME_DTYPE).tobytes())
+            self.npoints += len(points)
+            self.nstrokes += 1
+        self.ngestures += 1
+        return self.ngestures - 1
+
+    def coordinates(self, values):
+        """
+        :param values: array of coordinates
+        :return: the coordinates in the coordinate dtype of the store, rounded to the nearest integer for an integer
+            dtype (e.g. for resampled points) instead of truncated
+        """
+        if np.issubdtype(self.coord_dtype, np.integer):
+            values = np.rint(values)
+        return values.astype(self.coord_dtype)
+
+    def close(self):
+        """
+        Write the closing offsets, the label table and the header.
+        :return: void
+        """
+        self.files["strokes"].write(np.array([self.npoints], dtype=OFFSET_DTYPE).tobytes())
+        self.files["gestures"].write(np.array([self.nstrokes], dtype=OFFSET_DTYPE).tobytes())
+        for file in self.files.values():
+            file.close()
+        with open(os.path.join(self.directory, "labels.txt"), "w") as file:
+            for name in self.label_names:
+                file.write("{0}\n".format(name))
+        header = {"version": STORE_VERSION, "coord_dtype": self.coord_dtype.str, "npoints": self.npoints,
+                  "nstrokes": self.nstrokes, "ngestures": self.ngestures}
+        with open(os.path.join(self.directory, "header.json"), "w") as file:
+            json.dump(header, file)
+
+    def __enter__(self):
+        return self
+
+    def discard(self):
+        """
+        Close the column files without writing the header, so the incomplete store is not taken for a valid one.
+        :return: void
+        """
+        for file in self.files.values():
+            file.close()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class GestureStore:
+    """
+    Read-only, memory-mapped view on a store.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "header.json")) as file:
+            header = json.load(file)
+        if header["version"] != STORE_VERSION:
+            raise Exception("GestureStore: unsupported version {0} in {1}".format(header["version"], directory))
+        self.npoints = header["npoints"]
+        self.nstrokes = header["nstrokes"]
+        self.ngestures = header["ngestures"]
+        coord_dtype = header["coord_dtype"]
+        self.x = self.column("x", coord_dtype, self.npoints)
+        self.y = self.column("y", coord_dtype, self.npoints)
+        self.t = self.column("t", TIME_DTYPE, self.npoints)
+        self.stroke_offsets = self.column("strokes", OFFSET_DTYPE, self.nstrokes + 1)
+        self.gesture_offsets = self.column("gestures", OFFSET_DTYPE, self.ngestures + 1)
+        self.labels = self.column("labels", LABEL_DTYPE, self.ngestures)
+        with open(os.path.join(directory, "labels.txt")) as file:
+            self.label_names = [line.rstrip("\r\n") for line in file]
+        # Index of the first point of every gesture, followed by the number of points
+        self.point_offsets = self.stroke_offsets[self.gesture_offsets]
+
+    def column(self, name, dtype, length):
+        """
+        Memory-map one column of the store.
+        :param name: name of the column
+        :param dtype: dtype of the column
+        :param length: number of elements
+        :return: read-only numpy.memmap, or an empty array
+        """
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.directory, name + ".bin"), dtype=dtype, mode="r", shape=(length,))
+
+    def __len__(self):
+        return self.ngestures
+
+    def label(self, i):
+        """
+        :param i: index of a gesture
+        :return: label of the gesture
+        """
+        return self.label_names[self.labels[i]]
+
+    def gesture(self, i):
+        """
+        All points of a gesture, its strokes joined.
+        :param i: index of a gesture
+        :return: (n, 3) array of (x, y, time) points
+        """
+        a, b = self.point_offsets[i], self.point_offsets[i + 1]
+        return np.column_stack((self.x[a:b], self.y[a:b], self.t[a:b])).astype(np.float64)
+
+    def strokes(self, i):
+        """
+        The strokes of a gesture.
+        :param i: index of a gesture
+        :return: list of (n, 3) arrays of (x, y, time) points
+        """
+        bounds = self.stroke_offsets[self.gesture_offsets[i]:self.gesture_offsets[i + 1] + 1]
+        return [np.column_stack((self.x[a:b], self.y[a:b], self.t[a:b])).astype(np.float64)
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def batches(self, start=0, stop=None, size=BATCH_SIZE):
+        """
+        Iterate over consecutive batches of gestures, as views on the columns.
+        :param start: index of the first gesture
+        :param stop: index after the last gesture, the end of the store if not given
+        :param size: maximum number of gestures per batch
+        :return: generator of (first gesture, x, y, t, offsets), offsets relative to the batch
+        """
+        stop = self.ngestures if stop is None else stop
+        for first in range(start, stop, size):
+            last = min(first + size, stop)
+            a, b = self.point_offsets[first], self.point_offsets[last]
+            offsets = np.asarray(self.point_offsets[first:last + 1]) - a
+            yield first, self.x[a:b], self.y[a:b], self.t[a:b], offsets
+
+    def features(self, start=0, stop=None, size=BATCH_SIZE):
+        """
+        Featurize a range of gestures batch by batch with fv.RaggedFv, every gesture's strokes joined.
+        :param start: index of the first gesture
+        :param stop: index after the last gesture, the end of the store if not given
+        :param size: maximum number of gestures per batch
+        :return: (stop - start, NFEATURES) array of feature vectors
+        """
+        stop = self.ngestures if stop is None else stop
+        out = np.zeros((stop - start, fv.NFEATURES))
+        for first, x, y, t, offsets in self.batches(start, stop, size):
+            out[first - start:first - start + len(offsets) - 1] = fv.RaggedFv(x, y, t, offsets)
+        return out
+
+    def shape_labels(self, start=0, stop=None, size=BATCH_SIZE):
+        """
+        Classify a range of gestures as shapes batch by batch with shapes.classify_batch, e.g. to re-label ink.
+        :param start: index of the first gesture
+        :param stop: index after the last gesture, the end of the store if not given
+        :param size: maximum number of gestures per batch
+        :return: list of the shape label of every gesture
+        """
+        stop = self.ngestures if stop is None else stop
+        labels = []
+        for first, x, y, t, offsets in self.batches(start, stop, size):
+            last = first + len(offsets) - 1
+            a = self.point_offsets[first]
+            strokes = np.asarray(self.stroke_offsets[self.gesture_offsets[first]:self.gesture_offsets[last] + 1]) - a
+            labels.extend(shapes.classify_batch(x, y, offsets, strokes))
+        return labels
+
+
+def read_gesture(path):
+    """
+    Read a gesture file.
+    :param path: name of the file, with one "x y time" point per line
+    :return: (n, 3) array of points
+    """
+    return np.loadtxt(path, dtype=np.float64, ndmin=2).reshape(-1, 3)
+
+
+def list_corpus(directory):
+    """
+    List the gesture files of a corpus.
+    :param directory: corpus directory, with one subdirectory per class
+    :return: list of (class name, file name), sorted
+    """
+    files = []
+    for classname in sorted(os.listdir(directory)):
+        classdir = os.path.join(directory, classname)
+        if not os.path.isdir(classdir):
+            continue
+        for name in sorted(os.listdir(classdir)):
+            files.append((classname, os.path.join(classdir, name)))
+    return files
+
+
+def is_store(directory):
+    """
+    :param directory: name of a directory
+    :return: whether the directory holds a gesture store
+    """
+    return os.path.isfile(os.path.join(directory, "header.json"))
+
+
+def import_corpus(directory, store, coord_dtype="<i4"):
+    """
+    Convert a corpus directory (one subdirectory per class, one gesture file per gesture) to a store.
+    :param directory: corpus directory
+    :param store: store directory to write
+    :param coord_dtype: dtype of the coordinates
+    :return: number of gestures written
+    """
+    with GestureStoreWriter(store, coord_dtype) as writer:
+        for classname, path in list_corpus(directory):
+            writer.add_gesture(classname, [read_gesture(path)])
+        return writer.ngestures
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python corpus.py <corpus directory> <store directory>")
+        sys.exit(1)
+    print("Wrote {0} gestures".format(import_corpus(sys.argv[1], sys.argv[2])))
@@ -0,0 +1,347 @@
+"""
+Headless recognition engine: training and classification of Rubine gestures and classification of hand drawn
+shapes, working on plain point arrays. The tkinter applications are thin front ends over this engine, so it can
+also run in worker processes or benchmarks without a display.
+
+Raw points are resampled along their path by preprocess.py before they reach the featurizer (with preprocess set)
+or the shape filters (with preprocess_shapes set), so the cost of a gesture is bounded however many motion events
+the input device emits. For the featurizer it is off by default: train.py, corpus.py and the server featurize raw
+points, and classifiers trained there (like the shipped classifier.out) expect raw points. The shape filters have no
+trained model, their points are resampled by default.
+
+Every stage of the pipeline reports to instrument, which does nothing unless instrument.enable() was called.
+"""
+import fv
+import sc
+import geometry
+import instrument
+import preprocess
+import shapes
+
+# Eager recognition reports a class mid-stroke once the probability of unambiguous classification reaches
+# EAGER_THRESHOLD, but never before EAGER_MINPOINTS points have been seen
+EAGER_THRESHOLD = 0.95
+EAGER_MINPOINTS = 8
+
+
+class RecognitionEngine:
+    """
+    Recognizer for single stroke gestures (Rubine's feature vectors and statistical classifier) and for multi
+    stroke shapes (geometric filters).
+    """
+
+    def __init__(self, classifier=None):
+        # Preprocessing of the raw points, set preprocess to 1 to resample them, for classifiers trained that way
+        self.preprocess = 0
+        # Resampling of the strokes of shapes, which the shape filters do not depend on
+        self.preprocess_shapes = 1
+        self.spacing = preprocess.SPACING
+        self.max_points = preprocess.MAX_POINTS
+        self.smoothing = preprocess.SMOOTHING
+        # The stroke being drawn, fed point by point to add_point
+        self.live_resampler = self.resampler()
+        self.live_points = []
+
+        # Gesture classification
+        self.classifier = classifier if classifier is not None else sc.sClassifier()
+        self.trained = 0
+        # Set to 1 to featurize gestures with the vectorized fv.GestureFv
+        self.batch_fv = 0
+        # Eager recognition: the live feature vector of the stroke being drawn
+        self.eager_threshold = EAGER_THRESHOLD
+        self.eager_minpoints = EAGER_MINPOINTS
+        self.live_fv = fv.FV()
+        self.live_y = [0.0] * fv.NFEATURES
+        self.eager_scd = None
+
+        # Shape classification: strokes and geometry of the gesture being drawn, and the past gestures
+        self.strokes = []
+        self.geometry = geometry.GestureGeometry()
+        self.history = shapes.GestureHistory()
+
+    def resampler(self):
+        """
+        :return: a new preprocess.StreamResampler with the preprocessing settings of the engine
+        """
+        return preprocess.StreamResampler(self.spacing, self.max_points, self.smoothing)
+
+    def prepare(self, points, resample=None):
+        """
+        Preprocess the raw points of a stroke, unless preprocessing is turned off.
+        :param points: sequence of (x, y, time) or (x, y) points
+        :param resample: whether to resample the points, preprocess if not given
+        :return: sequence of points
+        """
+        if not (self.preprocess if resample is None else resample):
+            return points
+        with instrument.stage("preprocess"):
+            return preprocess.preprocess(points, self.spacing, self.max_points, self.smoothing)
+
+    def features(self, points):
+        """
+        Calculate the feature vector of a gesture.
+        :param points: sequence of raw (x, y, time) points
+        :return: feature vector
+        """
+        return self.featurize(self.prepare(points))
+
+    def featurize(self, points):
+        """
+        Calculate the feature vector of a gesture from its preprocessed points.
+        :param points: sequence of (x, y, time) points
+        :return: feature vector
+        """
+        instrument.observe("gesture_points", len(points))
+        with instrument.stage("featurize"):
+            if self.batch_fv:
+                return fv.GestureFv(points)
+            feature_vector = fv.FV()
+            for point in points:
+                feature_vector.AddPoint(point[0], point[1], point[2])
+        instrument.count("points_dropped", feature_vector.ndropped)
+        return feature_vector.FvCalc()
+
+    def add_example(self, classname, points):
+        """
+        Add a training example to the classifier.
+        :param classname: name of the class
+        :param points: sequence of (x, y, time) points
+        :return: void
+        """
+        self.classifier.sAddExample(classname, self.features(points))
+
+    def done_adding(self):
+        """
+        Train the classifier on the examples added so far.
+        :return: void
+        """
+        self.classifier.sDoneAdding()
+        self.trained = 1
+
+    def update_classifier(self):
+        """
+        Retrain a trained classifier on the examples added since, updating it instead of training it again.
+        :return: void
+        """
+        self.classifier.sUpdate()
+        self.trained = 1
+
+    def read_classifier(self, infile):
+        """
+        Replace the classifier by one read from a file.
+        :param infile: name of the classifier file
+        :return: void
+        """
+        # Only replace the classifier once it is read, it may be in use on another thread
+        classifier = sc.sClassifier()
+        classifier.read(infile)
+        self.classifier = classifier
+        self.trained = 1
+
+    def write_classifier(self, outfile):
+        """
+        Write the classifier to a file.
+        :param outfile: name of the classifier file
+        :return: void
+        """
+        self.classifier.write(outfile)
+
+    def classify(self, points):
+        """
+        Classify a gesture.
+        :param points: sequence of (x, y, time) points
+        :return: sClassDope, probability of unambiguous classification, distance from the class mean
+        """
+        y = self.features(points)
+        with instrument.stage("classify"):
+            return self.classifier.sClassifyAD(y)
+
+    def classify_batch(self, x, y, t, offsets):
+        """
+        Classify a ragged batch of gestures at once.
+        :param x: concatenated x-coordinates of all gestures
+        :param y: concatenated y-coordinates of all gestures
+        :param t: concatenated time values of all gestures
+        :param offsets: start index of every gesture, followed by the total number of points
+        :return: list of class names, array of probabilities of unambiguous classification,
+            array of distances from the class means
+        """
+        instrument.observe("batch_size", len(offsets) - 1)
+        with instrument.stage("featurize_batch"):
+            fvs = fv.RaggedFv(x, y, t, offsets)
+        with instrument.stage("classify_batch"):
+            classes, ap, dp = self.classifier.sClassifyBatch(fvs)
+        return [self.classifier.classdope[c].name for c in classes], ap, dp
+
+    def classify_shapes(self, x, y, offsets, stroke_offsets=None):
+        """
+        Classify a ragged batch of complete shapes at once. Unlike classify_shape the points are not preprocessed.
+        :param x: concatenated x-coordinates of all shapes
+        :param y: concatenated y-coordinates of all shapes
+        :param offsets: start index of every shape, followed by the total number of points
+        :param stroke_offsets: start index of every stroke, followed by the total number of points, every shape
+            being one stroke if not given
+        :return: list of the label of every shape
+        """
+        instrument.observe("batch_size", len(offsets) - 1)
+        with instrument.stage("shape_batch"):
+            return shapes.classify_batch(x, y, offsets, stroke_offsets)
+
+    def start_stroke(self):
+        """
+        Start a new stroke, to be fed point by point to add_point.
+        :return: void
+        """
+        self.live_fv = fv.FV()
+        self.live_resampler = self.resampler()
+        self.live_points = []
+        self.eager_scd = None
+
+    def add_point(self, x, y, t):
+        """
+        Feed a raw point of the stroke being drawn to the resampler, and the resampled points to the live feature
+            vector. Once the classifier is trained, classify the partial stroke until a decision has been made.
+        :param x: x-coordinate of the point
+        :param y: y-coordinate of the point
+        :param t: time value of the point
+        :return: (sClassDope, probability of unambiguous classification) the first time a class is decided on,
+            None else
+        """
+        with instrument.stage("add_point"):
+            if self.preprocess:
+                for p in self.live_resampler.add_point(x, y, t):
+                    self.live_fv.AddPoint(p[0], p[1], p[2])
+            else:
+                if self.preprocess_shapes:
+                    # Only finish_stroke reads the resampled points, the featurizer gets the raw ones
+                    self.live_resampler.add_point(x, y, t)
+                self.live_points.append((x, y, t))
+                self.live_fv.AddPoint(x, y, t)
+        if not self.trained or self.eager_scd is not None or self.live_fv.npoints < self.eager_minpoints:
+            return None
+        with instrument.stage("classify_eager"):
+            scd, ap, dp = self.classifier.sClassifyAD(self.live_fv.FvSnapshot(self.live_y), 1, 0)
+        if ap < self.eager_threshold:
+            return None
+        self.eager_scd = scd
+        return scd, ap
+
+    def end_stroke(self):
+        """
+        End the stroke fed to add_point.
+        :return: list of its (preprocessed) points
+        """
+        if self.preprocess:
+            return self.live_resampler.finish()
+        return self.live_points
+
+    def stroke_features(self):
+        """
+        Calculate the feature vector of the stroke fed to add_point. Without preprocessing the live feature vector
+            already holds the whole stroke, so this takes constant time; with preprocessing the resampled stroke (at
+            most max_points points) is featurized, exactly as features would.
+        :return: feature vector
+        """
+        if self.preprocess:
+            return self.featurize(self.end_stroke())
+        instrument.observe("gesture_points", self.live_fv.npoints + self.live_fv.ndropped)
+        instrument.count("points_dropped", self.live_fv.ndropped)
+        return self.live_fv.FvCalc()
+
+    def classify_features(self, y):
+        """
+        Classify a feature vector, e.g. as returned by stroke_features.
+        :param y: feature vector
+        :return: sClassDope, probability of unambiguous classification, distance from the class mean
+        """
+        with instrument.stage("classify"):
+            return self.classifier.sClassifyAD(y)
+
+    def classify_stroke(self):
+        """
+        Classify the stroke fed to add_point, without featurizing its points again.
+        :return: sClassDope, probability of unambiguous classification, distance from the class mean
+        """
+        return self.classify_features(self.stroke_features())
+
+    def classify_prepared(self, points):
+        """
+        Classify a gesture whose points were already preprocessed, e.g. as returned by end_stroke.
+        :param points: sequence of (x, y, time) points
+        :return: sClassDope, probability of unambiguous classification, distance from the class mean
+        """
+        return self.classify_features(self.featurize(points))
+
+    def add_stroke(self, points):
+        """
+        Add a completed stroke to the shape being drawn.
+        :param points: sequence of raw (x, y) or (x, y, time) points
+        :return: void
+        """
+        self.add_prepared_stroke(self.prepare(points, self.preprocess_shapes))
+
+    def finish_stroke(self):
+        """
+        Add the stroke fed to add_point to the shape being drawn.
+        :return: list of the (preprocessed) points of the stroke
+        """
+        points = self.live_resampler.finish() if self.preprocess_shapes else self.end_stroke()
+        self.add_prepared_stroke(points)
+        return points
+
+    def add_prepared_stroke(self, points):
+        """
+        Add a completed, preprocessed stroke to the shape being drawn.
+        :param points: sequence of (x, y) or (x, y, time) points
+        :return: void
+        """
+        if len(points) == 0:
+            return
+        self.strokes.append(points)
+        with instrument.stage("geometry"):
+            self.geometry.add_stroke(points)
+
+    def finish_gesture(self):
+        """
+        Classify the strokes added since the last call as one shape, and keep it in the history.
+        :return: the classified shapes.Gesture
+        """
+        gesture = self.take_gesture()
+        self.classify_gesture(gesture)
+        self.history.add(gesture)
+        return gesture
+
+    def take_gesture(self):
+        """
+        Take the strokes added since the last call as one shape, still to be classified. The engine no longer
+            touches the shape, so it can be classified on another thread.
+        :return: the unclassified shapes.Gesture
+        """
+        gesture = shapes.Gesture(self.geometry, self.strokes)
+        self.strokes = []
+        self.geometry = geometry.GestureGeometry()
+        return gesture
+
+    def classify_gesture(self, gesture):
+        """
+        Classify a shape taken with take_gesture, without adding it to the history.
+        :param gesture: shapes.Gesture to classify
+        :return: label of the shape
+        """
+        instrument.observe("shape_points", gesture.geometry.npoints)
+        with instrument.stage("shape_filters"):
+            return shapes.classify_gesture(gesture)
+
+    def classify_shape(self, strokes):
+        """
+        Classify a complete shape given as a list of strokes, without touching the shape being drawn.
+        :param strokes: list of strokes, every stroke a sequence of raw (x, y) points
+        :return: the classified shapes.Gesture
+        """
+        strokes = [self.prepare(stroke, self.preprocess_shapes) for stroke in strokes]
+        g = geometry.GestureGeometry()
+        for stroke in strokes:
+            g.add_stroke(stroke)
+        gesture = shapes.Gesture(g, strokes)
+        shapes.classify_gesture(gesture)
+        return gesture
@@ -17,7 +17,9 @@ from a sequence of points (e.g. mouse points).
 #define PF_ATH		9 /* sum of abs vals of angles traversed */
 #define PF_SQTH	10 /* sum of squares of angles traversed */
 """
+import array
 import math
+import numpy as np
 
 PF_INIT_COS = 0
 PF_INIT_SIN = 1
@@ -43,6 +45,10 @@ class FV:
     """
     Structure which holds intermediate results during feature vector calculation
     """
+    __slots__ = ("startx", "starty", "starttime", "initial_sin", "initial_cos", "npoints", "dx2", "dy2", "magsq2",
+                 "endx", "endy", "endtime", "minx", "maxx", "miny", "maxy", "path_r", "path_th", "abs_th",
+                 "sharpness", "maxv", "ndropped", "bbdirty", "bblen", "bbth", "sedirty", "selen", "secos", "sesin", "y")
+
     def __init__(self):
         # The following are used in calculating the features
         self.startx = 0
@@ -79,9 +85,20 @@ class FV:
         self.sharpness = 0
         # Maximum velocity
         self.maxv = 0
+        # Number of points ignored for being too close to the last point
+        self.ndropped = 0
+
+        # Bounding box and start-end features, only recomputed when the bounding box or last point changed
+        self.bbdirty = False
+        self.bblen = 0.0
+        self.bbth = 0.0
+        self.sedirty = False
+        self.selen = 0.0
+        self.secos = 0.0
+        self.sesin = 0.0
 
-        # Actual feature vector
-        self.y = [0.0 for i in range(NFEATURES)]
+        # Feature buffer used by FvSnapshot when no output is given
+        self.y = array.array("d", bytes(8 * NFEATURES))
 
     def AddPoint(self, x, y, t):
         """
@@ -113,16 +130,22 @@ class FV:
 
         if magsq1 <= dist_sq_threshold:
             self.npoints -= 1
+            self.ndropped += 1
             return  # Ignore a point close to the last point
         # Update some internal values if needed
         if x < self.minx:
             self.minx = x
+            self.bbdirty = True
         if x > self.maxx:
             self.maxx = x
+            self.bbdirty = True
         if y < self.miny:
             self.miny = y
+            self.bbdirty = True
         if y > self.maxy:
             self.maxy = y
+            self.bbdirty = True
+        self.sedirty = True
 
         lasttime = self.endtime
 
@@ -146,12 +169,8 @@ class FV:
             # Update angle based features
             th = math.atan2(dx1 * self.dy2 - self.dx2 * dy1,
                             dx1 * self.dx2 + dy1 * self.dy2)
-            absth = math.atan2(dx1 * self.dy2 - self.dx2 * dy1,
-                               dx1 * self.dx2 + dy1 * self.dy2)
-            if absth < 0:
-                absth = -absth
             self.path_th += th
-            self.abs_th += absth
+            self.abs_th += th if th >= 0 else -th
             self.sharpness += th * th
 
             # Compute max velocity
@@ -169,48 +188,250 @@ class FV:
 
     def FvCalc(self):
         """
-        Calculate and return a feature vector
-        :return: feature vector
+        Calculate and return a feature vector, without touching the state of the FV.
+        :return: feature vector, a new list on every call
+        """
+        return self.FvSnapshot([0.0] * NFEATURES)
+
+    def FvSnapshot(self, out=None):
+        """
+        Write the current feature vector into a preallocated buffer, e.g. a list, an array or a row of a NumPy
+            matrix, without allocating anything.
+        :param out: buffer of at least NFEATURES elements, the internal buffer self.y if not given
+        :return: out
         """
+        if out is None:
+            out = self.y
         if self.npoints <= 1:
-            return self.y   # A feature vector of all zeros
-        self.y[PF_INIT_COS] = self.initial_cos
-        self.y[PF_INIT_SIN] = self.initial_sin
+            # A feature vector of all zeros
+            for i in range(NFEATURES):
+                out[i] = 0.0
+            return out
+
+        if self.bbdirty:
+            # Compute the length of the bounding box diagonal
+            self.bblen = math.hypot(self.maxx - self.minx, self.maxy - self.miny)
+            # The bounding box angle defaults to 0 for small gestures
+            if self.bblen * self.bblen > dist_sq_threshold:
+                self.bbth = math.atan2(self.maxy - self.miny, self.maxx - self.minx)
+            else:
+                self.bbth = 0.0
+            self.bbdirty = False
+
+        if self.sedirty:
+            # Compute the length and angle between the first and last points
+            self.selen = math.hypot(self.endx - self.startx, self.endy - self.starty)
+
+            # When the first and last points are very close,
+            # the angle features are muted so that they satisfy the stability criterion
+            factor = self.selen * self.selen / se_th_rolloff
+            if factor > 1.0:
+                factor = 1.0
+
+            if self.selen > EPS:
+                factor /= self.selen
+            else:
+                factor = 0
+            self.secos = (self.endx - self.startx) * factor
+            self.sesin = (self.endy - self.starty) * factor
+            self.sedirty = False
+
+        out[PF_INIT_COS] = self.initial_cos
+        out[PF_INIT_SIN] = self.initial_sin
+        out[PF_BB_LEN] = self.bblen
+        out[PF_BB_TH] = self.bbth
+        out[PF_SE_LEN] = self.selen
+        out[PF_SE_COS] = self.secos
+        out[PF_SE_SIN] = self.sesin
 
-        # Compute the length of the bounding box diagonal
-        bblen = math.hypot(self.maxx - self.minx, self.maxy - self.miny)
+        # The remaining features have already been computed
+        out[PF_LEN] = self.path_r
+        out[PF_TH] = self.path_th
+        out[PF_ATH] = self.abs_th
+        out[PF_SQTH] = self.sharpness
 
-        self.y[PF_BB_LEN] = bblen
+        out[PF_DUR] = (self.endtime - self.starttime) * .01  # Convert to seconds
 
-        # The bounding box angle defaults to 0 for small gestures
-        if bblen * bblen > dist_sq_threshold:
-            self.y[PF_BB_TH] = math.atan2(self.maxy - self.miny, self.maxx - self.minx)
+        out[PF_MAXV] = self.maxv * 10000  # Correction term of 10e4
 
-        # Compute the length and angle between the first and last points
-        selen = math.hypot(self.endx - self.startx, self.endy - self.starty)
-        self.y[PF_SE_LEN] = selen
+        return out
 
-        # When the first and last points are very close,
-        # the angle features are muted so that they satisfy the stability criterion
-        factor = selen * selen / se_th_rolloff
-        if factor > 1.0:
-            factor = 1.0
 
-        if selen > EPS:
-            factor /= selen
-        else:
-            factor = 0
-        self.y[PF_SE_COS] = (self.endx - self.startx) * factor
-        self.y[PF_SE_SIN] = (self.endy - self.starty) * factor
+def FvSnapshotBatch(fvs, out):
+    """
+    Write the current feature vectors of several live FVs into the rows of one shared matrix.
+    :param fvs: sequence of FV
+    :param out: (len(fvs), NFEATURES) NumPy matrix
+    :return: out
+    """
+    for i in range(len(fvs)):
+        fvs[i].FvSnapshot(out[i])
+    return out
 
-        # The remaining features have already been computed
-        self.y[PF_LEN] = self.path_r
-        self.y[PF_TH] = self.path_th
-        self.y[PF_ATH] = self.abs_th
-        self.y[PF_SQTH] = self.sharpness
 
-        self.y[PF_DUR] = (self.endtime - self.starttime) * .01  # Convert to seconds
+def KeepMask(x, y, offsets):
+    """
+    Compute which points of a ragged batch of strokes survive the dist_sq_threshold test of AddPoint.
+    A point is only compared to the last point that was kept, so this is inherently sequential; it is done on
+    plain floats so that everything afterwards can be vectorized.
+    :param x: concatenated x-coordinates of all strokes
+    :param y: concatenated y-coordinates of all strokes
+    :param offsets: start index of every stroke, followed by the total number of points
+    :return: boolean array, True for every point AddPoint would keep
+    """
+    xs = np.asarray(x, dtype=np.float64).tolist()
+    ys = np.asarray(y, dtype=np.float64).tolist()
+    keep = np.zeros(len(xs), dtype=bool)
+    for s in range(len(offsets) - 1):
+        start, end = int(offsets[s]), int(offsets[s + 1])
+        if start == end:
+            continue
+        keep[start] = True
+        endx, endy = xs[start], ys[start]
+        for i in range(start + 1, end):
+            dx = xs[i] - endx
+            dy = ys[i] - endy
+            if dx * dx + dy * dy > dist_sq_threshold:
+                keep[i] = True
+                endx, endy = xs[i], ys[i]
+    return keep
+
+
+def RaggedFv(x, y, t, offsets):
+    """
+    Calculate the feature vectors of a ragged batch of strokes in one pass.
+    The result matches feeding every stroke through AddPoint and calling FvCalc, up to float rounding.
+    :param x: concatenated x-coordinates of all strokes
+    :param y: concatenated y-coordinates of all strokes
+    :param t: concatenated time values of all strokes
+    :param offsets: start index of every stroke, followed by the total number of points
+    :return: (nstrokes, NFEATURES) array of feature vectors
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    nstrokes = len(offsets) - 1
+    out = np.zeros((max(nstrokes, 0), NFEATURES))
+    if nstrokes <= 0:
+        return out
+
+    # Drop the points AddPoint would ignore, and give every remaining point its stroke and position in it
+    keep = KeepMask(x, y, offsets)
+    x, y, t = x[keep], y[keep], t[keep]
+    counts = np.diff(np.concatenate(([0], np.cumsum(keep, dtype=np.int64)))[offsets])
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    stroke = np.repeat(np.arange(nstrokes), counts)
+    pos = np.arange(len(x)) - starts[stroke]
+
+    # Segment i goes from point i to point i + 1, within a single stroke
+    dx = np.diff(x)
+    dy = np.diff(y)
+    dt = np.diff(t)
+    seg = stroke[1:]
+    inside = seg == stroke[:-1]
+    d = np.sqrt(dx * dx + dy * dy)
+    path_r = np.bincount(seg[inside], weights=d[inside], minlength=nstrokes)
+
+    # Angle features: turn between the previous and the current segment, from the third point on
+    turn = inside[1:] & inside[:-1]
+    dx1, dy1 = dx[1:][turn], dy[1:][turn]
+    dx2, dy2 = dx[:-1][turn], dy[:-1][turn]
+    # Adding 0.0 turns -0.0 into 0.0, so a full reversal gives +pi just like atan2 on integer coordinates
+    th = np.arctan2(dx1 * dy2 - dx2 * dy1 + 0.0, dx1 * dx2 + dy1 * dy2)
+    turn_stroke = seg[1:][turn]
+    path_th = np.bincount(turn_stroke, weights=th, minlength=nstrokes)
+    abs_th = np.bincount(turn_stroke, weights=np.abs(th), minlength=nstrokes)
+    sharpness = np.bincount(turn_stroke, weights=th * th, minlength=nstrokes)
+
+    # Maximum velocity, also only from the third point on
+    fast = inside & (pos[1:] >= 2) & (dt > 0)
+    maxv = np.zeros(nstrokes)
+    np.maximum.at(maxv, seg[fast], d[fast] / dt[fast])
+
+    # Initial angle, from the first to the third point
+    third = starts[counts >= 3] + 2
+    ix = x[third] - x[third - 2]
+    iy = y[third] - y[third - 2]
+    magsq = ix * ix + iy * iy
+    far = magsq > dist_sq_threshold
+    recip = 1.0 / np.sqrt(magsq[far])
+    out[stroke[third[far]], PF_INIT_COS] = ix[far] * recip
+    out[stroke[third[far]], PF_INIT_SIN] = iy[far] * recip
+
+    # Bounding box, reduced over the non empty strokes so that every slice is exactly one stroke
+    nonempty = counts > 0
+    bounds = starts[nonempty]
+    width = np.zeros(nstrokes)
+    height = np.zeros(nstrokes)
+    if len(bounds):
+        width[nonempty] = np.maximum.reduceat(x, bounds) - np.minimum.reduceat(x, bounds)
+        height[nonempty] = np.maximum.reduceat(y, bounds) - np.minimum.reduceat(y, bounds)
+    bblen = np.hypot(width, height)
+    out[:, PF_BB_LEN] = bblen
+    big = bblen * bblen > dist_sq_threshold
+    out[big, PF_BB_TH] = np.arctan2(height[big], width[big])
+
+    # Length and angle between the first and last points, muted when they are very close
+    first = starts[nonempty]
+    last = first + counts[nonempty] - 1
+    sex = np.zeros(nstrokes)
+    sey = np.zeros(nstrokes)
+    dur = np.zeros(nstrokes)
+    sex[nonempty] = x[last] - x[first]
+    sey[nonempty] = y[last] - y[first]
+    dur[nonempty] = t[last] - t[first]
+    selen = np.hypot(sex, sey)
+    factor = np.minimum(selen * selen / se_th_rolloff, 1.0)
+    factor = np.where(selen > EPS, factor / np.where(selen > EPS, selen, 1.0), 0.0)
+    out[:, PF_SE_LEN] = selen
+    out[:, PF_SE_COS] = sex * factor
+    out[:, PF_SE_SIN] = sey * factor
+
+    out[:, PF_LEN] = path_r
+    out[:, PF_TH] = path_th
+    out[:, PF_ATH] = abs_th
+    out[:, PF_SQTH] = sharpness
+    out[:, PF_DUR] = dur * .01  # Convert to seconds
+    out[:, PF_MAXV] = maxv * 10000  # Correction term of 10e4
+
+    # A stroke of at most one point has a feature vector of all zeros
+    out[counts <= 1] = 0.0
+    return out
+
+
+def PaddedFv(x, y, t, lengths):
+    """
+    Calculate the feature vectors of a padded batch of strokes.
+    :param x: (nstrokes, maxlen) array of x-coordinates
+    :param y: (nstrokes, maxlen) array of y-coordinates
+    :param t: (nstrokes, maxlen) array of time values
+    :param lengths: number of valid points in every row, the rest is padding
+    :return: (nstrokes, NFEATURES) array of feature vectors
+    """
+    x = np.asarray(x)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    valid = np.arange(x.shape[1]) < lengths[:, None]
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    return RaggedFv(x[valid], np.asarray(y)[valid], np.asarray(t)[valid], offsets)
+
+
+def StrokeFv(x, y, t):
+    """
+    Calculate the feature vector of a single stroke given as arrays.
+    :param x: x-coordinates of the stroke
+    :param y: y-coordinates of the stroke
+    :param t: time values of the stroke
+    :return: feature vector as an array of NFEATURES values
+    """
+    return RaggedFv(x, y, t, [0, len(x)])[0]
 
-        self.y[PF_MAXV] = self.maxv * 10000 # Correction term of 10e4
 
-        return self.y
+def GestureFv(gesture):
+    """
+    Calculate the feature vector of a gesture given as a sequence of (x, y, time) points.
+    :param gesture: sequence of (x, y, time) points
+    :return: feature vector as an array of NFEATURES values
+    """
+    points = np.asarray(gesture, dtype=np.float64).reshape(-1, 3)
+    return StrokeFv(points[:, 0], points[:, 1], points[:, 2])
@@ -1,7 +1,10 @@
 import fv
 
 
-def InputAGesture(gesture):
+def InputAGesture(gesture, batch=0):
+    if batch:
+        # Featurize the whole gesture at once with the vectorized engine
+        return fv.GestureFv(gesture)
     feature_vector = fv.FV()
     for point in gesture:
         feature_vector.AddPoint(point[0], point[1], point[2])
@@ -0,0 +1,319 @@
+"""
+Geometry of hand drawn gestures, kept up to date incrementally as strokes are added.
+"""
+import math
+import numpy as np
+
+# Smallest angle between two consecutive segments that makes a corner: that of a slope of 0.5
+CORNER_ANGLE = math.atan(0.5)
+# Backend of convex_hull: "numpy" for the built-in monotone chain, "scipy" for Qhull, imported when first used
+HULL_BACKEND = "numpy"
+# Relative size of the cross product below which three points are taken as collinear by the monotone chain
+COLLINEAR = 1e-12
+
+
+def chains(x, y, keep, line):
+    """
+    Find chains of convex hulls: every pass drops, for all chains at once, every point that does not make a strict
+    turn (counterclockwise along a lower chain, clockwise along an upper one) with its neighbours still in the
+    chain; such a point is never a vertex of the hull.
+    :param x: x-coordinates of the points
+    :param y: y-coordinates of the points
+    :param keep: indices of the candidate points of all chains, sorted by chain, then x, then y
+    :param line: chain of every candidate point, even for lower chains and odd for upper chains
+    :return: indices of the points of the chains, and the chain of every point
+    """
+    sign = np.where(line % 2 == 0, 1.0, -1.0)
+    while len(keep) > 2:
+        # Only the points with a neighbour of their own chain on both sides can be dropped
+        inner = np.flatnonzero((line[1:-1] == line[:-2]) & (line[1:-1] == line[2:])) + 1
+        a, b, c = keep[inner - 1], keep[inner], keep[inner + 1]
+        abx, aby, acx, acy = x[b] - x[a], y[b] - y[a], x[c] - x[a], y[c] - y[a]
+        cross = sign[inner] * (abx * acy - aby * acx)
+        # Turns within rounding error of collinear are not turns
+        drop = cross <= COLLINEAR * (np.abs(abx) + np.abs(aby)) * (np.abs(acx) + np.abs(acy))
+        if not np.any(drop):
+            break
+        mask = np.ones(len(keep), dtype=bool)
+        mask[inner[drop]] = False
+        keep, line, sign = keep[mask], line[mask], sign[mask]
+    return keep, line
+
+
+def convex_hulls(x, y, offsets):
+    """
+    Calculate the convex hull of every point set of a ragged batch at once with Andrew's monotone chain.
+    :param x: concatenated x-coordinates of all point sets
+    :param y: concatenated y-coordinates of all point sets
+    :param offsets: start index of every point set, followed by the total number of points
+    :return: (m, 2) array of the concatenated hull vertices, every hull counterclockwise starting from its
+        lowest x (then y), and the start index of every hull followed by m. A hull of (nearly) collinear points
+        is its two extreme points, that of coincident points a single point.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)[offsets[0]:offsets[-1]]
+    y = np.asarray(y, dtype=np.float64)[offsets[0]:offsets[-1]]
+    ngroups = len(offsets) - 1
+    group = np.repeat(np.arange(ngroups), np.diff(offsets))
+    if len(x) == 0:
+        return np.zeros((0, 2)), np.zeros(len(offsets), dtype=np.int64)
+    order = np.lexsort((y, x, group))
+    x, y, group = x[order], y[order], group[order]
+    # Coincident points would make each other look collinear, keep one of them
+    unique = np.ones(len(x), dtype=bool)
+    unique[1:] = (x[1:] != x[:-1]) | (y[1:] != y[:-1]) | (group[1:] != group[:-1])
+    x, y, group = x[unique], y[unique], group[unique]
+
+    # The lower chain of a group runs below the line from its first to its last point, the upper chain above it
+    counts = np.bincount(group, minlength=ngroups)
+    last = np.cumsum(counts) - 1
+    first = last - counts + 1
+    f, l = np.repeat(first, counts), np.repeat(last, counts)
+    side = (x[l] - x[f]) * (y - y[f]) - (y[l] - y[f]) * (x - x[f])
+    index = np.arange(len(x))
+    ends = (index == f) | (index == l)
+    lower = np.flatnonzero(ends | (side < 0))
+    upper = np.flatnonzero(ends | (side > 0))
+    # The lower chain of group g is chain 2g, its upper chain chain 2g + 1
+    keep, line = chains(x, y, np.concatenate((lower, upper)), np.concatenate((2 * group[lower], 2 * group[upper] + 1)))
+    order = np.argsort(line, kind="stable")
+    keep, line = keep[order], line[order]
+
+    # The hull is the lower chain without its last point, followed by the upper chain backwards without its first
+    # point, the last point of the group; a single point is kept once
+    upper_chain = line % 2 == 1
+    chain_end = np.append(line[1:] != line[:-1], True)
+    chain_start = np.append(True, line[1:] != line[:-1])
+    single = counts[line // 2] == 1
+    selected = np.where(upper_chain, ~chain_start & ~single, ~chain_end | single)
+    keep, upper_chain = keep[selected], upper_chain[selected]
+    vertices = keep[np.lexsort((np.where(upper_chain, -keep, keep), upper_chain, group[keep]))]
+    counts = np.bincount(group[vertices], minlength=ngroups)
+    return np.column_stack((x[vertices], y[vertices])), np.concatenate(([0], np.cumsum(counts)))
+
+
+def convex_hull(points, backend=None):
+    """
+    Calculate the convex hull of a set of points.
+    :param points: array of points [(xi, yi)]
+    :param backend: "numpy" or "scipy", HULL_BACKEND if not given
+    :return: array of the hull vertices in counterclockwise order
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 3:
+        return points
+    backend = HULL_BACKEND if backend is None else backend
+    if backend == "numpy":
+        return convex_hulls(points[:, 0], points[:, 1], [0, len(points)])[0]
+    elif backend != "scipy":
+        raise Exception("convex_hull: unknown backend {0}".format(backend))
+    # SciPy is only imported when asked for, it takes long to import
+    from scipy.spatial import ConvexHull, QhullError
+    try:
+        hull = ConvexHull(points)
+    except QhullError:
+        # All points are (nearly) collinear, the hull degenerates to the two extreme points
+        order = np.lexsort((points[:, 1], points[:, 0]))
+        return points[[order[0], order[-1]]]
+    return points[hull.vertices]
+
+
+def polygon_perimeter(vertices):
+    """
+    Calculate the perimeter of a closed polygon.
+    :param vertices: array of the polygon vertices [(xi, yi)]
+    :return: perimeter of the polygon
+    """
+    if len(vertices) < 2:
+        return 0.0
+    closed = np.vstack((vertices, vertices[:1]))
+    return float(np.sum(np.hypot(np.diff(closed[:, 0]), np.diff(closed[:, 1]))))
+
+
+def hull_perimeters(x, y, offsets):
+    """
+    Calculate the perimeter of the convex hull of every gesture of a ragged batch.
+    :param x: concatenated x-coordinates of all gestures
+    :param y: concatenated y-coordinates of all gestures
+    :param offsets: start index of every gesture, followed by the total number of points
+    :return: array of the hull perimeter of every gesture, 0.0 for gestures with less than two points
+    """
+    vertices, hull_offsets = convex_hulls(x, y, offsets)
+    counts = np.diff(hull_offsets)
+    # Every vertex is followed by the next one of its hull, the last one by the first
+    following = np.arange(1, len(vertices) + 1)
+    following[hull_offsets[1:][counts > 0] - 1] = hull_offsets[:-1][counts > 0]
+    edges = np.hypot(vertices[following, 0] - vertices[:, 0], vertices[following, 1] - vertices[:, 1])
+    perimeters = np.zeros(len(counts))
+    np.add.at(perimeters, np.repeat(np.arange(len(counts)), counts), edges)
+    return perimeters
+
+
+class GestureGeometry:
+    """
+    Convex hull, shoelace area, path length and bounding box of a gesture, updated as every stroke is added.
+    Adding a stroke costs O(new points), not a rebuild over all the points of the gesture. The convex hull is only
+    updated when it is read, from the old hull and the points added since, so a gesture whose hull is never needed
+    never pays for it.
+    """
+
+    def __init__(self):
+        self.npoints = 0
+        self.nstrokes = 0
+        # Vertices of the convex hull as of the last time it was read, counterclockwise, and the points added since
+        self.hull_vertices = np.zeros((0, 2))
+        self.hull_pending = []
+        # Shoelace sum over every pair of consecutive points, strokes joined end to start
+        self.cross = 0.0
+        # Length of the path through all points, strokes joined end to start
+        self.path_length = 0.0
+        self.first = None
+        self.last = None
+        # Bounding box: min x, max x, min y, max y
+        self.bbox = (np.inf, -np.inf, np.inf, -np.inf)
+        # Area of the polygon through all points, closed from the last point back to the first (Shoelace method)
+        self.area = 0.0
+        # Perimeter of the convex hull as of the last time it was read
+        self.perimeter = 0.0
+
+    def update_hull(self):
+        """
+        Bring the convex hull up to date with the points added since it was last read.
+        :return: void
+        """
+        if self.hull_pending:
+            # Only the old hull vertices can be on the new hull, next to the new points
+            self.hull_vertices = convex_hull(np.vstack([self.hull_vertices] + self.hull_pending))
+            self.hull_pending = []
+            self.perimeter = polygon_perimeter(self.hull_vertices)
+
+    @property
+    def hull(self):
+        """
+        :return: array of the vertices of the convex hull of all points, counterclockwise
+        """
+        self.update_hull()
+        return self.hull_vertices
+
+    @property
+    def hull_perimeter(self):
+        """
+        :return: perimeter of the convex hull of all points
+        """
+        self.update_hull()
+        return self.perimeter
+
+    def add_stroke(self, points):
+        """
+        Add the points of a new stroke to the gesture.
+        :param points: array of points [(xi, yi)], extra columns (e.g. time) are ignored
+        :return: void
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if len(points) == 0:
+            return
+        points = points[:, :2]
+        self.nstrokes += 1
+        self.npoints += len(points)
+
+        # Join the new stroke to the end of the previous one, just like one flat list of all points
+        chain = points if self.last is None else np.vstack((self.last, points))
+        x = chain[:, 0]
+        y = chain[:, 1]
+        self.cross += float(np.dot(x[:-1], y[1:]) - np.dot(y[:-1], x[1:]))
+        self.path_length += float(np.sum(np.hypot(np.diff(x), np.diff(y))))
+        if self.first is None:
+            self.first = points[0]
+        self.last = points[-1]
+        correction = self.last[0] * self.first[1] - self.last[1] * self.first[0]
+        self.area = 0.5 * abs(self.cross + correction)
+
+        self.bbox = (min(self.bbox[0], float(np.min(points[:, 0]))), max(self.bbox[1], float(np.max(points[:, 0]))),
+                     min(self.bbox[2], float(np.min(points[:, 1]))), max(self.bbox[3], float(np.max(points[:, 1]))))
+        self.hull_pending.append(points)
+
+
+def segment_moments(x, y, offsets):
+    """
+    Calculate the means and centered second moments of the points of every segment of a sketch at once.
+    :param x: concatenated x-coordinates of all segments
+    :param y: concatenated y-coordinates of all segments
+    :param offsets: start index of every segment, followed by the total number of points
+    :return: number of points, mean x, mean y, sum of dx * dx, dy * dy and dx * dy of every segment, the moments
+        nan for empty segments
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)[offsets[0]:offsets[-1]]
+    y = np.asarray(y, dtype=np.float64)[offsets[0]:offsets[-1]]
+    counts = np.diff(offsets)
+    moments = [np.full(len(counts), np.nan) for _ in range(5)]
+    nonempty = counts > 0
+    if not np.any(nonempty):
+        return (counts,) + tuple(moments)
+    # Empty segments are skipped, so that every slice of reduceat is exactly one segment
+    starts = offsets[:-1][nonempty] - offsets[0]
+    n = counts[nonempty]
+    mx = np.add.reduceat(x, starts) / n
+    my = np.add.reduceat(y, starts) / n
+    # Center every segment on its own mean before summing the second moments
+    dx = x - np.repeat(mx, n)
+    dy = y - np.repeat(my, n)
+    for moment, value in zip(moments, (mx, my, np.add.reduceat(dx * dx, starts), np.add.reduceat(dy * dy, starts),
+                                       np.add.reduceat(dx * dy, starts))):
+        moment[nonempty] = value
+    return (counts,) + tuple(moments)
+
+
+def segment_directions(x, y, offsets):
+    """
+    Calculate the direction of every segment (e.g. stroke) of a sketch at once, as the orientation of the line
+    fitted through its points by (total) least squares. Unlike a regression slope this also works for vertical lines.
+    :param x: concatenated x-coordinates of all segments
+    :param y: concatenated y-coordinates of all segments
+    :param offsets: start index of every segment, followed by the total number of points
+    :return: angle of every segment in (-pi/2, pi/2], nan for segments with less than two points
+    """
+    n, mx, my, sxx, syy, sxy = segment_moments(x, y, offsets)
+    theta = 0.5 * np.arctan2(2 * sxy, sxx - syy)
+    theta[n < 2] = np.nan
+    return theta
+
+
+def fit_lines(x, y, offsets):
+    """
+    Fit a line y = slope * x + intercept through the points of every segment of a sketch at once by ordinary least
+    squares, like scipy.stats.linregress does for one segment.
+    :param x: concatenated x-coordinates of all segments
+    :param y: concatenated y-coordinates of all segments
+    :param offsets: start index of every segment, followed by the total number of points
+    :return: arrays of the slope, intercept and correlation coefficient of every segment, nan where undefined
+        (less than two points, or all points with the same x)
+    """
+    n, mx, my, sxx, syy, sxy = segment_moments(x, y, offsets)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+        r = np.where((sxx > 0) & (syy > 0), sxy / np.sqrt(sxx * syy), np.where(sxx > 0, 0.0, np.nan))
+    return slope, my - slope * mx, np.clip(r, -1.0, 1.0)
+
+
+def find_corners(x, y, offsets, threshold=CORNER_ANGLE):
+    """
+    Find the corners of a closed sketch made of segments: wherever the direction of a segment differs from that of
+    the previous one (the last segment being followed by the first) by more than threshold.
+    :param x: concatenated x-coordinates of all segments
+    :param y: concatenated y-coordinates of all segments
+    :param offsets: start index of every segment, followed by the total number of points
+    :param threshold: smallest angle between two segments, in radians, that counts as a corner
+    :return: indices of the corner points, the first point of the segment after every corner
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    theta = segment_directions(x, y, offsets)
+    if len(theta) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Lines have no orientation, so angles are compared modulo pi
+    turn = np.abs(np.roll(theta, -1) - theta) % np.pi
+    turn = np.minimum(turn, np.pi - turn)
+    with np.errstate(invalid="ignore"):
+        corner = turn > threshold
+    # A corner between segment i and i + 1 sits at the start of segment i + 1, wrapping around to the first one
+    return np.roll(offsets[:-1], -1)[corner]
@@ -0,0 +1,126 @@
+"""
+Ink rendering for the tkinter front ends: every stroke is drawn as a few line items that are extended as points come
+in, instead of one canvas item per motion event.
+
+A stroke is split in chunks of at most CHUNK_POINTS points, only the last chunk is updated when a point is added, so
+drawing a point costs the same however long the stroke or the session is. Points closer than MIN_DISTANCE to the
+last drawn point are not drawn, this decimation is for display only: the recognizer gets every point. All items of a
+stroke share a tag, and all strokes the tag of the layer, so a stroke or the whole layer is cleared with one delete.
+"""
+import math
+
+# Largest number of points of one line item
+CHUNK_POINTS = 64
+# Smallest distance in pixels between two drawn points
+MIN_DISTANCE = 2.0
+WIDTH = 2
+FILL = "black"
+
+
+class InkLayer:
+    """
+    The strokes drawn on a canvas.
+    """
+
+    def __init__(self, canvas, tag="ink", width=WIDTH, fill=FILL, min_distance=MIN_DISTANCE,
+                 chunk_points=CHUNK_POINTS):
+        self.canvas = canvas
+        self.tag = tag
+        self.width = width
+        self.fill = fill
+        self.min_distance = min_distance
+        self.chunk_points = max(chunk_points, 2)
+        self.nstrokes = 0
+        # The stroke being drawn: its tag, the line item of its last chunk and the coordinates in that chunk
+        self.stroke = None
+        self.item = None
+        self.coords = []
+        # Last point added, and whether it was drawn
+        self.last = None
+        self.drawn = True
+
+    def start_stroke(self):
+        """
+        Start a new stroke, ending the one being drawn.
+        :return: tag of the new stroke
+        """
+        self.end_stroke()
+        self.nstrokes += 1
+        self.stroke = "{0}-{1}".format(self.tag, self.nstrokes)
+        self.item = None
+        self.coords = []
+        self.last = None
+        self.drawn = True
+        return self.stroke
+
+    def add_point(self, x, y):
+        """
+        Add a point to the stroke being drawn, starting a stroke if there is none.
+        :param x: x-coordinate of the point
+        :param y: y-coordinate of the point
+        :return: void
+        """
+        if self.stroke is None:
+            self.start_stroke()
+        if self.coords:
+            px, py = self.coords[-2], self.coords[-1]
+            if math.hypot(x - px, y - py) < self.min_distance:
+                self.last = (x, y)
+                self.drawn = False
+                return
+        self.draw(x, y)
+
+    def draw(self, x, y):
+        """
+        Append a point to the last chunk of the stroke being drawn, starting a new chunk when it is full.
+        :return: void
+        """
+        self.last = (x, y)
+        self.drawn = True
+        if len(self.coords) >= 2 * self.chunk_points:
+            # The new chunk starts where the full one ends, so the stroke stays connected
+            self.coords = self.coords[-2:]
+            self.item = None
+        self.coords.extend((x, y))
+        if self.item is None:
+            # A single point is drawn as a dot, the line from the point to itself
+            coords = self.coords if len(self.coords) > 2 else self.coords * 2
+            self.item = self.canvas.create_line(*coords, width=self.width, fill=self.fill, capstyle="round",
+                                                joinstyle="round", tags=(self.tag, self.stroke))
+        else:
+            self.canvas.coords(self.item, *self.coords)
+
+    def end_stroke(self):
+        """
+        End the stroke being drawn, drawing its last point if it was decimated.
+        :return: tag of the stroke, None if no stroke was being drawn
+        """
+        stroke = self.stroke
+        if stroke is not None and not self.drawn:
+            self.draw(*self.last)
+        self.stroke = None
+        self.item = None
+        self.coords = []
+        return stroke
+
+    def clear_stroke(self, stroke):
+        """
+        Remove one stroke from the canvas.
+        :param stroke: tag of the stroke
+        :return: void
+        """
+        if stroke == self.stroke:
+            self.stroke = None
+            self.item = None
+            self.coords = []
+        self.canvas.delete(stroke)
+
+    def clear(self):
+        """
+        Remove all strokes from the canvas.
+        :return: void
+        """
+        self.stroke = None
+        self.item = None
+        self.coords = []
+        self.canvas.delete(self.tag)
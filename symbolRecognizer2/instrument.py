@@ -0,0 +1,274 @@
+"""
+Opt-in instrumentation of the recognition pipeline: per stage timers, counters and HDR-style histograms.
+
+Instrumentation is disabled by default, every hook then costs one global lookup and returns. Enable it with
+enable(), and export what was measured with snapshot() (a dict) or prometheus() (Prometheus text format):
+
+    import instrument
+    instrument.enable()
+    with instrument.stage("featurize"):
+        ...
+    instrument.count("points_dropped", n)
+    instrument.observe("gesture_points", npoints)
+    print(instrument.prometheus())
+"""
+import contextlib
+import math
+import time
+
+# Histograms have 2 ** SUB_BITS buckets for every power of two, so every value is kept to within 1 / 2 ** SUB_BITS
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+# Timers are recorded in nanoseconds
+TIME_UNIT = 1e-9
+PERCENTILES = (50, 90, 99, 99.9)
+PROMETHEUS_PREFIX = "recognizer_"
+
+
+class Histogram:
+    """
+    Log-linear histogram of non-negative values, in the style of HdrHistogram: values below 2 * SUB_BUCKETS units
+    are counted exactly, larger ones in buckets whose width grows with every power of two.
+    """
+
+    def __init__(self, unit=1.0):
+        # Values are counted in integer multiples of unit
+        self.unit = unit
+        self.counts = []
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @staticmethod
+    def bucket(v):
+        """
+        :param v: value in units, non-negative integer
+        :return: index of the bucket of the value
+        """
+        if v < 2 * SUB_BUCKETS:
+            return v
+        shift = v.bit_length() - SUB_BITS - 1
+        return shift * SUB_BUCKETS + (v >> shift)
+
+    @staticmethod
+    def lower(b):
+        """
+        :param b: index of a bucket
+        :return: smallest value in units of the bucket
+        """
+        if b < 2 * SUB_BUCKETS:
+            return b
+        shift = b // SUB_BUCKETS - 1
+        return (b - shift * SUB_BUCKETS) << shift
+
+    def record(self, value):
+        """
+        Count a value.
+        :param value: value to count, negative values are counted as 0
+        :return: void
+        """
+        b = self.bucket(max(int(value / self.unit), 0))
+        if b >= len(self.counts):
+            self.counts.extend([0] * (b + 1 - len(self.counts)))
+        self.counts[b] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """
+        :param q: percentile, between 0 and 100
+        :return: the value at the percentile, accurate to the width of its bucket, 0.0 if nothing was counted
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(math.ceil(q / 100.0 * self.count), 1)
+        seen = 0
+        for b, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                # Middle of the bucket, clamped to the values actually seen
+                middle = (self.lower(b) + self.lower(b + 1) - 1) / 2.0 * self.unit
+                return min(max(middle, self.min), self.max)
+        return self.max
+
+    def buckets(self):
+        """
+        :return: list of (upper bound, cumulative count) of every non-empty bucket
+        """
+        cumulative = []
+        seen = 0
+        for b, n in enumerate(self.counts):
+            if n:
+                seen += n
+                cumulative.append((self.lower(b + 1) * self.unit, seen))
+        return cumulative
+
+    def snapshot(self):
+        """
+        :return: dict with the count, sum, min, max, mean and percentiles of the values
+        """
+        if self.count == 0:
+            return {"count": 0, "sum": 0.0}
+        stats = {"count": self.count, "sum": self.total, "min": self.min, "max": self.max,
+                 "mean": self.total / self.count}
+        for q in PERCENTILES:
+            stats["p{0:g}".format(q)] = self.percentile(q)
+        return stats
+
+
+class Registry:
+    """
+    Named counters and histograms.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def histogram(self, name, unit=1.0):
+        """
+        :return: the histogram with the given name, created with the given unit if there is none yet
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(unit)
+        return histogram
+
+    def snapshot(self):
+        """
+        :return: dict with a dict of counters and a dict of histogram snapshots
+        """
+        return {"counters": dict(self.counters),
+                "histograms": {name: h.snapshot() for name, h in self.histograms.items()}}
+
+    def prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """
+        :param prefix: prefix of every metric name
+        :return: the counters and histograms in the Prometheus text exposition format
+        """
+        lines = []
+        for name in sorted(self.counters):
+            lines.append("# TYPE {0}{1}_total counter".format(prefix, name))
+            lines.append("{0}{1}_total {2}".format(prefix, name, self.counters[name]))
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            lines.append("# TYPE {0}{1} histogram".format(prefix, name))
+            for bound, n in h.buckets():
+                lines.append('{0}{1}_bucket{{le="{2:.9g}"}} {3}'.format(prefix, name, bound, n))
+            lines.append('{0}{1}_bucket{{le="+Inf"}} {2}'.format(prefix, name, h.count))
+            lines.append("{0}{1}_sum {2:.9g}".format(prefix, name, h.total))
+            lines.append("{0}{1}_count {2}".format(prefix, name, h.count))
+        return "\n".join(lines) + "\n"
+
+
+class Stage:
+    """
+    Context manager that times a stage into the histogram "<name>_seconds".
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+# The active registry, None while instrumentation is disabled
+registry = None
+NULL_STAGE = contextlib.nullcontext()
+
+
+def enable():
+    """
+    Enable instrumentation, keeping what was measured before if it already was enabled.
+    :return: the active Registry
+    """
+    global registry
+    if registry is None:
+        registry = Registry()
+    return registry
+
+
+def disable():
+    """
+    Disable instrumentation and drop everything measured.
+    :return: void
+    """
+    global registry
+    registry = None
+
+
+def enabled():
+    return registry is not None
+
+
+def stage(name):
+    """
+    Time a stage of the pipeline: with instrument.stage("name"): ...
+    :param name: name of the stage
+    :return: context manager, doing nothing while instrumentation is disabled
+    """
+    if registry is None:
+        return NULL_STAGE
+    return Stage(registry.histogram(name + "_seconds", TIME_UNIT))
+
+
+def timed(name, seconds):
+    """
+    Record the duration of a stage timed by the caller.
+    :param name: name of the stage
+    :param seconds: duration
+    :return: void
+    """
+    if registry is not None:
+        registry.histogram(name + "_seconds", TIME_UNIT).record(seconds)
+
+
+def count(name, n=1):
+    """
+    Add to a counter.
+    :param name: name of the counter
+    :param n: amount to add
+    :return: void
+    """
+    if registry is not None:
+        registry.count(name, n)
+
+
+def observe(name, value):
+    """
+    Record a value, e.g. a gesture size, in a histogram.
+    :param name: name of the histogram
+    :param value: non-negative value
+    :return: void
+    """
+    if registry is not None:
+        registry.histogram(name).record(value)
+
+
+def snapshot():
+    """
+    :return: dict of everything measured, empty while instrumentation is disabled
+    """
+    return registry.snapshot() if registry is not None else {}
+
+
+def prometheus(prefix=PROMETHEUS_PREFIX):
+    """
+    :return: everything measured in the Prometheus text exposition format, empty while instrumentation is disabled
+    """
+    return registry.prometheus(prefix) if registry is not None else ""
@@ -0,0 +1,146 @@
+"""
+Preprocessing of raw input points ahead of feature extraction and the shape filters: optional smoothing,
+arc-length resampling to a bounded number of points and time normalization.
+
+The number of raw motion events of a stroke depends on the speed of the hand and the event rate of the device.
+After resampling the points are evenly spaced along the path, and a stroke never holds more than a fixed budget of
+points, so the cost of featurizing and classifying it is bounded whatever the device emits.
+"""
+import math
+import numpy as np
+
+# Initial distance between resampled points, larger than the distance below which fv.FV ignores points
+SPACING = 5.0
+# Largest number of points of a resampled stroke
+MAX_POINTS = 256
+# Weight of the previous position in the exponential smoothing of the raw points, 0.0 for no smoothing
+SMOOTHING = 0.0
+
+
+class StreamResampler:
+    """
+    Resample a stroke point by point while it is being drawn. Points are emitted every spacing units of path
+    length, interpolated between the raw points. Whenever the budget of points is reached, every other point is
+    dropped and the spacing is doubled, so the points stay evenly spaced. Time values are made relative to the
+    first point and never decrease.
+    """
+
+    def __init__(self, spacing=SPACING, max_points=MAX_POINTS, smoothing=SMOOTHING):
+        self.spacing = spacing
+        self.max_points = max(max_points, 2)
+        self.smoothing = smoothing
+        # Resampled points (x, y, time) so far
+        self.points = []
+        # Last raw point, after smoothing, and the path length from the last resampled point up to it
+        self.last = None
+        self.travelled = 0.0
+        self.t0 = 0.0
+
+    def add_point(self, x, y, t):
+        """
+        Add a raw point.
+        :param x: x-coordinate of the point
+        :param y: y-coordinate of the point
+        :param t: time value of the point
+        :return: list of the resampled points (x, y, time) emitted because of it, possibly empty
+        """
+        if self.last is None:
+            self.t0 = t
+            self.last = (x, y, 0.0)
+            self.points.append(self.last)
+            return [self.last]
+
+        px, py, pt = self.last
+        if self.smoothing > 0.0:
+            x = self.smoothing * px + (1.0 - self.smoothing) * x
+            y = self.smoothing * py + (1.0 - self.smoothing) * y
+        t = max(t - self.t0, pt)
+
+        emitted = []
+        d = math.hypot(x - px, y - py)
+        while d > 0.0 and self.travelled + d >= self.spacing:
+            f = (self.spacing - self.travelled) / d
+            px, py, pt = px + f * (x - px), py + f * (y - py), pt + f * (t - pt)
+            emitted.append((px, py, pt))
+            self.emit((px, py, pt))
+            d = math.hypot(x - px, y - py)
+        self.travelled += d
+        self.last = (x, y, t)
+        return emitted
+
+    def emit(self, point):
+        """
+        Append a resampled point, halving the points when the budget is reached.
+        :param point: (x, y, time)
+        :return: void
+        """
+        self.points.append(point)
+        self.travelled = 0.0
+        if len(self.points) >= self.max_points:
+            # Keep the even points, the path since the last one kept now includes the dropped last point
+            if len(self.points) % 2 == 0:
+                self.travelled = self.spacing
+            del self.points[1::2]
+            self.spacing *= 2
+
+    def finish(self):
+        """
+        End the stroke, adding its last raw point when it is not the last resampled point.
+        :return: list of the resampled points (x, y, time) of the stroke
+        """
+        if self.last is not None and self.travelled > 0.0:
+            self.points.append(self.last)
+            self.travelled = 0.0
+        return self.points
+
+
+def preprocess(points, spacing=SPACING, max_points=MAX_POINTS, smoothing=SMOOTHING):
+    """
+    Preprocess a complete stroke, exactly as StreamResampler does point by point.
+    :param points: sequence of (x, y, time) points, or (x, y) points for which the time is taken as 0
+    :param spacing: initial distance between resampled points
+    :param max_points: largest number of resampled points
+    :param smoothing: weight of the previous position in the exponential smoothing, 0.0 for no smoothing
+    :return: list of resampled (x, y, time) points
+    """
+    resampler = StreamResampler(spacing, max_points, smoothing)
+    for p in points:
+        resampler.add_point(p[0], p[1], p[2] if len(p) > 2 else 0.0)
+    return resampler.finish()
+
+
+def resample(points, n):
+    """
+    Resample a stroke to exactly n points evenly spaced along its path, interpolating the time values.
+    :param points: sequence of (x, y, time) points
+    :param n: number of points to resample to
+    :return: (n, 3) array of points, empty when there are no points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+    if len(points) == 0:
+        return np.zeros((0, 3))
+    if points.shape[1] < 3:
+        points = np.column_stack((points[:, :2], np.zeros(len(points))))
+    arc = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1])))))
+    if arc[-1] == 0.0:
+        return np.repeat(points[:1, :3], n, axis=0)
+    s = np.linspace(0.0, arc[-1], n)
+    return np.column_stack([np.interp(s, arc, points[:, i]) for i in range(3)])
+
+
+def normalize_time(points, duration=None):
+    """
+    Make the time values of a stroke relative to its first point and non-decreasing, optionally scaled to a
+    fixed duration.
+    :param points: sequence of (x, y, time) points
+    :param duration: duration of the stroke after scaling, not scaled if not given
+    :return: (n, 3) array of points
+    """
+    points = np.array(points, dtype=np.float64).reshape(len(points), -1)
+    if len(points) == 0:
+        return points
+    t = np.maximum.accumulate(points[:, 2] - points[0, 2])
+    if duration is not None and t[-1] > 0:
+        t *= duration / t[-1]
+    points[:, 2] = t
+    return points
@@ -1,39 +1,47 @@
 import tkinter
-import sc
-import fv
+import engine
+import ink
+import worker
 
 dim_x = 950
 dim_y = 750
 
 
 class Recognizer(tkinter.Frame):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, master=None, recognition_engine=None):
+        super().__init__(master)
 
         # Create canvas on window
-        self.canvas = tkinter.Canvas(width=dim_x, height=dim_y)
+        self.canvas = tkinter.Canvas(master, width=dim_x, height=dim_y)
         self.canvas.pack(expand=1)
 
-        self.entry1 = tkinter.Entry(root)
+        self.entry1 = tkinter.Entry(master)
         self.canvas.create_window(200, 140, window=self.entry1)
 
-        self.label1 = tkinter.Label(root, text="Class name")
+        self.label1 = tkinter.Label(master, text="Class name")
         self.canvas.create_window(200, 120, window=self.label1)
 
-        self.button1 = tkinter.Button(text='Record example', command=self.training)
+        self.button1 = tkinter.Button(master, text='Record example', command=self.training)
         self.canvas.create_window(200, 165, window=self.button1)
 
-        self.button2 = tkinter.Button(text='Import classifier', command=self.read_classifier)
+        self.button2 = tkinter.Button(master, text='Import classifier', command=self.read_classifier)
         self.canvas.create_window(300, 165, window=self.button2)
 
         self.init_canvas()
 
-        self.classifier = sc.sClassifier()
+        # All training and classification is done by the headless engine
+        self.engine = recognition_engine if recognition_engine is not None else engine.RecognitionEngine()
         self.is_training = 1
         self.take_input = 0
         self.points = []
-        self.ovals = []
+        # Strokes are drawn as a few line items each, all removed at once when the stroke is saved
+        self.ink = ink.InkLayer(self.canvas)
         self.training_name = ""
+        # Eager recognition: classify while the stroke is being drawn, using a live feature vector
+        self.eager = 1
+        # Training and classification run in order on a worker thread, the results are polled from the main loop
+        self.worker = worker.RecognitionWorker()
+        self.worker.attach(self.canvas)
 
     def init_canvas(self):
         # Bind actions
@@ -46,9 +54,8 @@ class Recognizer(tkinter.Frame):
     def training(self):
         name = self.entry1.get()
         if name == "" or name == "quit":
-            self.classifier.sDoneAdding()
-            self.classifier.write("classifier.out")
-            print("Wrote classifier to file")
+            self.worker.submit(self.finish_training, lambda result: print("Wrote classifier to file"),
+                               droppable=False)
             self.entry1.place_forget()
             self.label1.place_forget()
             self.button1.place_forget()
@@ -56,12 +63,21 @@ class Recognizer(tkinter.Frame):
             self.take_input = 1
             self.is_training = 0
         else:
+            # Also after training: the next stroke is an extra example, the classifier is updated with it
             self.take_input = 1
+            self.is_training = 1
             self.training_name = name
 
+    def finish_training(self):
+        # After training, every extra example has already updated the classifier
+        if not self.engine.trained:
+            self.engine.done_adding()
+        self.engine.write_classifier("classifier.out")
+
     def read_classifier(self):
-        self.classifier = sc.sClassifier()
-        self.classifier.read("classifier.out")
+        # Classifications still queued were asked of the old classifier
+        self.worker.cancel()
+        self.worker.submit(lambda: self.engine.read_classifier("classifier.out"), droppable=False)
         self.entry1.place_forget()
         self.label1.place_forget()
         self.button1.place_forget()
@@ -73,19 +89,27 @@ class Recognizer(tkinter.Frame):
     def stroke(self, event):
         if self.take_input:
             self.points.append((event.x, event.y, event.time))
-            # python_green = "#476042"
-            x1, y1 = (event.x - 1), (event.y - 1)
-            x2, y2 = (event.x + 1), (event.y + 1)
-            oval = self.canvas.create_oval(x1, y1, x2, y2)
-            self.ovals.append(oval)
+            self.ink.add_point(event.x, event.y)
             # print(self.points)
+            if self.eager and not self.is_training:
+                self.eager_point(event.x, event.y, event.time)
+
+    def eager_point(self, x, y, t):
+        """
+        Feed a point to the live feature vector of the engine, and report the class once it has been decided on.
+        :param x: x-coordinate of the point
+        :param y: y-coordinate of the point
+        :param t: time value of the point
+        :return: void
+        """
+        decision = self.engine.add_point(x, y, t)
+        if decision is not None:
+            scd, ap = decision
+            print("Gesture eagerly classified as {0} after {1} points\n".format(scd.name, self.engine.live_fv.npoints))
+            print("Probability of unambiguous classification: {0}\n".format(ap))
 
     def InputAGesture(self, gesture):
-        feature_vector = fv.FV()
-        for point in gesture:
-            feature_vector.AddPoint(point[0], point[1], point[2])
-        v = feature_vector.FvCalc()
-        return v
+        return self.engine.features(gesture)
 
     # Left mouse button is released, save stroke
     def save_stroke(self, event):
@@ -93,24 +117,59 @@ class Recognizer(tkinter.Frame):
         if self.take_input:
             if self.is_training:
                 self.take_input = 0
-                self.classifier.sAddExample(self.training_name, self.InputAGesture(self.points))
                 self.entry1.delete(0, 'end')
+                name, points = self.training_name, self.points
+                self.worker.submit(lambda: self.add_example(name, points), self.example_added, droppable=False)
             elif not self.is_training:
-                scd, ap, dp = self.classifier.sClassifyAD(self.InputAGesture(self.points))
-                print("Gesture classified as {0}\n".format(scd.name))
-                print("Probability of unambiguous classification: {0}\n".format(ap))
-                print("Distance from class mean: {0}\n".format(dp))
-            for o in self.ovals:
-                self.canvas.delete(o)
+                if self.eager:
+                    # The live feature vector already holds the whole stroke, so its points are not featurized
+                    # again. It is read here, before start_stroke replaces it, and only classified on the worker
+                    y = self.engine.stroke_features()
+                    self.worker.submit(lambda: self.engine.classify_features(y), self.report)
+                else:
+                    points = self.points
+                    self.worker.submit(lambda: self.engine.classify(points), self.report)
+            self.ink.clear()
             self.points = []
-            self.ovals = []
+        self.engine.start_stroke()
+
+    def add_example(self, name, points):
+        """
+        Add a training example, and update the classifier with it once it is trained. Runs on the worker thread.
+        :return: (name, whether the update succeeded) if the classifier is trained, None else
+        """
+        self.engine.add_example(name, points)
+        if not self.engine.trained:
+            return None
+        try:
+            self.engine.update_classifier()
+        except Exception as e:
+            print(e)
+            return name, False
+        return name, True
+
+    def example_added(self, update):
+        if update is None:
+            return
+        name, updated = update
+        if updated:
+            print("Updated classifier with an example of {0}\n".format(name))
+        self.take_input = 1
+        self.is_training = 0
+
+    def report(self, result):
+        scd, ap, dp = result
+        print("Gesture classified as {0}\n".format(scd.name))
+        print("Probability of unambiguous classification: {0}\n".format(ap))
+        print("Distance from class mean: {0}\n".format(dp))
 
 
-# Create window
-root = tkinter.Tk()
-root.geometry("{0}x{1}".format(dim_x, dim_y))
+if __name__ == "__main__":
+    # Create window
+    root = tkinter.Tk()
+    root.geometry("{0}x{1}".format(dim_x, dim_y))
 
-recognizer = Recognizer()
+    recognizer = Recognizer(root)
 
-# Run
-root.mainloop()
+    # Run
+    root.mainloop()
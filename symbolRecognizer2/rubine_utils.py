@@ -65,6 +65,100 @@ def DeSliceMatrix(m, fill, rowmask, colmask, result):
     return result
 
 
+def ForwardSubstitution(l, b):
+    """
+    Solve L X = B for a lower triangular matrix L, with LAPACK.
+    :param l: (n, n) lower triangular matrix
+    :param b: right hand side, a vector of length n or an (n, m) matrix
+    :return: X, with the shape of b
+    """
+    return np.linalg.solve(np.tril(l), np.asarray(b, dtype=np.float64))
+
+
+def BackSubstitution(u, b):
+    """
+    Solve U X = B for an upper triangular matrix U, with LAPACK.
+    :param u: (n, n) upper triangular matrix
+    :param b: right hand side, a vector of length n or an (n, m) matrix
+    :return: X, with the shape of b
+    """
+    return np.linalg.solve(np.triu(u), np.asarray(b, dtype=np.float64))
+
+
+def PivotedCholesky(mat, eps):
+    """
+    Cholesky factorization of a symmetric positive semi-definite matrix with diagonal pivoting, leaving out
+        dependent rows and columns. At every step the row whose diagonal element is least explained by the rows
+        chosen so far (relative to the diagonal element itself, so the scale of a feature does not matter) is chosen
+        next; once the unexplained part of every remaining row is at most eps times its diagonal element (or the
+        diagonal element is not positive), the remaining rows are dependent and left out. The kept rows are then
+        factored in their original order with LAPACK.
+    :param mat: (n, n) symmetric matrix
+    :param eps: relative tolerance below which a row counts as dependent
+    :return: (k, k) lower triangular factor L of the kept rows and columns, with L L' = mat[keep][:, keep],
+        and a boolean mask of the k kept rows
+    """
+    mat = np.asarray(mat, dtype=np.float64)
+    n = len(mat)
+    keep = np.zeros(n, dtype=bool)
+    diagonal = np.diag(mat).copy()
+    positive = diagonal > 0.0
+    # Columns of the partial factor of the pivots chosen so far, and the unexplained part of every diagonal element
+    columns = np.zeros((n, 0))
+    residual = diagonal.copy()
+    for k in range(n):
+        relative = np.where(positive & ~keep, residual / np.where(positive, diagonal, 1.0), -np.inf)
+        pivot = int(np.argmax(relative))
+        if relative[pivot] <= eps:
+            break
+        column = (mat[:, pivot] - np.dot(columns, columns[pivot])) / np.sqrt(residual[pivot])
+        column[keep] = 0.0
+        column[pivot] = np.sqrt(residual[pivot])
+        columns = np.column_stack((columns, column))
+        residual -= column * column
+        keep[pivot] = True
+    if not np.any(keep):
+        return np.zeros((0, 0)), keep
+    return np.linalg.cholesky(mat[np.ix_(keep, keep)]), keep
+
+
+def CholeskyUpdate(l, v):
+    """
+    Rank-1 update of a Cholesky factor: given L with L L' = A, compute the factor of A + v v', in O(n^2).
+    :param l: (n, n) lower triangular factor
+    :param v: vector of length n
+    :return: updated (n, n) lower triangular factor
+    """
+    l = np.array(l, dtype=np.float64)
+    v = np.array(v, dtype=np.float64)
+    for k in range(len(l)):
+        r = np.hypot(l[k, k], v[k])
+        c = r / l[k, k]
+        s = v[k] / l[k, k]
+        l[k, k] = r
+        l[k + 1:, k] = (l[k + 1:, k] + s * v[k + 1:]) / c
+        v[k + 1:] = c * v[k + 1:] - s * l[k + 1:, k]
+    return l
+
+
+def AsVector(vector):
+    """
+    Convert a vector whose elements may be floats, numpy scalars or 1x1 matrices to a float array.
+    :param vector: vector to convert
+    :return: 1-D float64 array
+    """
+    return np.array([np.asarray(v, dtype=np.float64).item() for v in vector], dtype=np.float64)
+
+
+def AsMatrix(matrix):
+    """
+    Convert a matrix given as a list of rows to a 2-D float array.
+    :param matrix: matrix to convert
+    :return: 2-D float64 array
+    """
+    return np.array([AsVector(row) for row in matrix], dtype=np.float64).reshape(len(matrix), -1)
+
+
 def OutputVector(vector):
     """
     Return 1 line writeable version of the vector
@@ -3,12 +3,28 @@ Create single path classifiers from feature vectors of examples,
 as well as classifying example feature vectors.
 """
 import math
+import os
+import struct
+import sys
 import numpy as np
 import rubine_utils as ru
+import instrument
 
-MAXSCLASSES = 100
+# A feature whose variance is explained by the other features kept up to this fraction is left out by sDoneAdding
 EPS = math.pow(10, -6)
 
+# Binary classifier files start with this header: magic, version, number of classes, number of features, flags
+# and the length of the class name table. The table (names separated by NUL bytes) follows, padded to
+# BINARY_ALIGN bytes, and then the little-endian float64 blocks: averages (nclasses x nfeatures),
+# weights (nclasses x nfeatures), constants (nclasses) and the inverse average covariance (nfeatures x nfeatures).
+# With BINARY_STATISTICS set in flags, the training statistics follow: the number of examples (nclasses) and the
+# covariance matrices times the number of examples - 1 (nclasses x nfeatures x nfeatures) of every class.
+BINARY_MAGIC = b"SCLF"
+BINARY_VERSION = 1
+BINARY_HEADER = "<4sIIIIQ"
+BINARY_ALIGN = 8
+BINARY_STATISTICS = 1
+
 
 class sClassDope:
     """
@@ -35,9 +51,22 @@ class sClassifier:
         self.cnst = []
         self.w = []
         self.invavgcov = [[]]
-        self.lastsc = self
-        self.lastscd = sClassDope()
-        self.space = []
+        # Stacked form of w, cnst and the class averages, built once training or reading is done
+        self.wmat = None
+        self.cnstvec = None
+        self.avgmat = None
+        self.invmat = None
+        # Cholesky factor L of the avg covariance matrix of the features in featuremask, set by sDoneAdding
+        self.chol = None
+        self.featuremask = None
+        # Whitening matrix R with R' R = invavgcov (L^-1 on the features in featuremask), for Mahalanobis distances
+        self.whiten = None
+        # Degrees of freedom the factor was computed with (number of examples - number of classes), and the
+        # changes of the pooled covariance matrix (times the degrees of freedom) since then, as rank-1 terms
+        self.denom = 0
+        self.pending = []
+        # Index from class name to per class information, maintained by sAddClass
+        self.classindex = {}
 
     def sClassNameLookup(self, classname):
         """
@@ -45,18 +74,7 @@ class sClassifier:
         :param classname: name of the class
         :return: sClassDope if it exists, 0 else
         """
-        # Quick check for last class name
-        if self.lastsc == self and (self.lastscd.name == classname):
-            return self.lastscd
-
-        # Linear search through all classes for name
-        for i in range(self.nclasses):
-            scd = self.classdope[i]
-            if scd.name == classname:
-                self.lastsc = self
-                self.lastscd = scd
-                return self.lastscd
-        return 0
+        return self.classindex.get(classname, 0)
 
     def sAddClass(self, classname):
         """
@@ -70,6 +88,7 @@ class sClassifier:
         scd.number = self.nclasses
         scd.nexamples = 0
         scd.sumcov = [[]]
+        self.classindex[classname] = scd
         self.nclasses += 1
         return scd
 
@@ -80,9 +99,6 @@ class sClassifier:
         :param y: feature vector
         :return: void
         """
-        # New feature vector
-        nfv = [0 for i in range(50)]
-
         # Search for the classname in existing scd's, add new if not found
         scd = self.sClassNameLookup(classname)
         if scd == 0:
@@ -94,8 +110,8 @@ class sClassifier:
 
         # If this is the first example of the sClassDope, set some values
         if scd.nexamples == 0:
-            scd.average = [0 for i in range(self.nfeatures)]
-            scd.sumcov = [[0 for i in range(self.nfeatures)] for j in range(self.nfeatures)]
+            scd.average = np.zeros(self.nfeatures)
+            scd.sumcov = np.zeros((self.nfeatures, self.nfeatures))
 
         if self.nfeatures != len(y):
             print(y, " sAddExample: funny vector nrows!={0}".format(self.nfeatures))
@@ -105,18 +121,69 @@ class sClassifier:
         nm1on = (scd.nexamples - 1.0) / scd.nexamples
         recipn = 1.0 / scd.nexamples
 
-        # Incrementally update covariance matrix
-        for i in range(self.nfeatures):
-            nfv[i] = y[i] - scd.average[i]
+        # Incrementally update covariance matrix (rank-1 update, both triangles) and mean vector
+        delta = np.asarray(y, dtype=np.float64) - scd.average
+        scd.sumcov += nm1on * np.outer(delta, delta)
+        scd.average += recipn * delta
+        if self.chol is not None and nm1on > 0:
+            self.pending.append(math.sqrt(nm1on) * delta)
 
-        # Only upper triangular part computed
-        for i in range(self.nfeatures):
-            for j in range(i, self.nfeatures):
-                scd.sumcov[i][j] += nm1on * nfv[i] * nfv[j]
+    def sAddExamples(self, classname, ys):
+        """
+        Add a block of training examples of the same class to a classifier at once.
+        :param classname: name of the class
+        :param ys: (n, nfeatures) array of feature vectors
+        :return: void
+        """
+        ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+        if len(ys) == 0:
+            return
+        average = ys.mean(axis=0)
+        space = ys - average
+        self.sAddStatistics(classname, len(ys), average, np.dot(space.T, space))
 
-        # Incrementally update mean vector
-        for i in range(self.nfeatures):
-            scd.average[i] = nm1on * scd.average[i] + recipn * y[i]
+    def sAddStatistics(self, classname, n, average, sumcov):
+        """
+        Merge the statistics of a set of training examples into a class, using the pairwise combination of
+            means and covariance matrices.
+        :param classname: name of the class
+        :param n: number of examples
+        :param average: average of the examples
+        :param sumcov: covariance matrix of the examples (times the number of examples - 1)
+        :return: void
+        """
+        if n <= 0:
+            return
+        average = np.asarray(average, dtype=np.float64)
+        sumcov = np.asarray(sumcov, dtype=np.float64)
+
+        scd = self.sClassNameLookup(classname)
+        if scd == 0:
+            scd = self.sAddClass(classname)
+
+        if self.nfeatures == -1:
+            self.nfeatures = len(average)
+
+        if self.nfeatures != len(average):
+            print(average, " sAddStatistics: funny vector nrows!={0}".format(self.nfeatures))
+            return
+
+        if scd.nexamples == 0:
+            scd.average = np.zeros(self.nfeatures)
+            scd.sumcov = np.zeros((self.nfeatures, self.nfeatures))
+
+        total = scd.nexamples + n
+        delta = average - scd.average
+        scd.sumcov += sumcov + (scd.nexamples * n / total) * np.outer(delta, delta)
+        if self.chol is not None:
+            # Split the change of the pooled covariance matrix in rank-1 terms for sUpdate
+            values, vectors = np.linalg.eigh(sumcov)
+            positive = values > 0.0
+            self.pending.extend(vectors[:, positive].T * np.sqrt(values[positive])[:, None])
+            if scd.nexamples > 0:
+                self.pending.append(math.sqrt(scd.nexamples * n / total) * delta)
+        scd.average += (n / total) * delta
+        scd.nexamples = total
 
     def sDoneAdding(self):
         """
@@ -126,47 +193,101 @@ class sClassifier:
         if self.nclasses == 0:
             raise Exception("sDoneAdding: No classes\n")
 
-        # Given covariance matrices for each class ( number of examples	- 1),
-        # compute the average (common) covariance matrix
-        avgcov = [[0 for i in range(self.nfeatures)] for j in range(self.nfeatures)]
+        avgcov, denom = self.PooledCovariance()
+        if denom <= 0:
+            print("no examples, denom={0}\n".format(denom))
+            return
+
+        # Factor the avg covariance matrix once, leaving out features that depend on the ones kept
+        self.chol, self.featuremask = ru.PivotedCholesky(avgcov, EPS)
+        if not np.any(self.featuremask):
+            raise Exception("sDoneAdding: all features are constant")
+        if not np.all(self.featuremask):
+            print("sDoneAdding: ignoring dependent features {0}\n".format(np.flatnonzero(~self.featuremask)))
+        self.denom = denom
+        self.pending = []
+        self.DeriveWeights()
+
+    def PooledCovariance(self):
+        """
+        Compute the average (common) covariance matrix of all classes from their covariance matrices
+            (times the number of examples - 1).
+        :return: average covariance matrix, degrees of freedom (number of examples - number of classes)
+        """
+        avgcov = np.zeros((self.nfeatures, self.nfeatures))
         ne = 0
         for c in range(self.nclasses):
             scd = self.classdope[c]
+            if scd.nexamples == 0:
+                continue
             ne += scd.nexamples
-            s = scd.sumcov
-            for i in range(self.nfeatures):
-                for j in range(i, self.nfeatures):
-                    avgcov[i][j] += s[i][j]
+            avgcov += scd.sumcov
 
         denom = ne - self.nclasses
-        if denom <= 0:
-            print("no examples, denom={0}\n".format(denom))
-            return
-
-        oneoverdenom = 1.0 / denom
-        for i in range(self.nfeatures):
-            for j in range(i, self.nfeatures):
-                avgcov[i][j] *= oneoverdenom
-                avgcov[j][i] = avgcov[i][j]
+        if denom > 0:
+            avgcov /= denom
+        return avgcov, denom
 
-        # Invert the avg covariance matrix
-        self.invavgcov = np.linalg.inv(avgcov)#matrix(avgcov).I
-        det = 0
-        try:
-            det = np.linalg.det(self.invavgcov)
-        except:
-            pass
-        if math.fabs(det) <= EPS:
-            self.FixClassifier(avgcov)
-
-        # Now compute discrimination functions
-        self.w = [[] for i in range(self.nclasses)]
+    def DeriveWeights(self):
+        """
+        Compute the discrimination functions and the inverse avg covariance matrix from the class averages and the
+            Cholesky factor of the avg covariance matrix.
+        :return: void
+        """
+        mask = self.featuremask
+
+        # Distances are taken through L^-1, the inverse is only kept for the classifier file; both are zero for
+        # left out features
+        linv = ru.ForwardSubstitution(self.chol, np.eye(len(self.chol)))
+        self.whiten = np.zeros((len(linv), self.nfeatures))
+        self.whiten[:, mask] = linv
+        self.invavgcov = np.dot(self.whiten.T, self.whiten)
+
+        # Now compute discrimination functions, w = avgcov^-1 average by two triangular solves for all classes
+        averages = np.array([self.classdope[c].average for c in range(self.nclasses)])
+        wmask = ru.BackSubstitution(self.chol.T, ru.ForwardSubstitution(self.chol, averages[:, mask].T))
+        self.w = [np.zeros(self.nfeatures) for i in range(self.nclasses)]
         self.cnst = [None for i in range(self.nclasses)]
         for c in range(self.nclasses):
-            scd = self.classdope[c]
-            self.w[c] = np.dot(scd.average, self.invavgcov)
-            self.cnst[c] = -0.5 * np.inner(self.w[c], scd.average)
-        return
+            self.w[c][mask] = wmask[:, c]
+            self.cnst[c] = -0.5 * np.inner(self.w[c], averages[c])
+        self.StackWeights()
+
+    def sUpdate(self):
+        """
+        Retrain a trained classifier after examples or classes have been added to it, updating the Cholesky factor
+            with the pending rank-1 terms instead of factoring the avg covariance matrix again. A full sDoneAdding
+            is done instead when there are more terms than features, or when features were left out (new examples
+            may make them independent).
+        :return: void
+        """
+        if self.chol is None:
+            raise Exception("sUpdate: {0} has no training statistics, use sDoneAdding".format(self))
+        if len(self.pending) > self.nfeatures or not np.all(self.featuremask):
+            self.sDoneAdding()
+            return
+        avgcov, denom = self.PooledCovariance()
+
+        # Factor of the pooled covariance matrix times the degrees of freedom, updated with every term
+        chol = self.chol * math.sqrt(self.denom)
+        for v in self.pending:
+            chol = ru.CholeskyUpdate(chol, v[self.featuremask])
+        self.chol = chol / math.sqrt(denom)
+        self.denom = denom
+        self.pending = []
+        self.DeriveWeights()
+
+    def StackWeights(self):
+        """
+        Stack the per class weights, constants and averages into a weight matrix, bias vector and average matrix
+            (and the inverse covariance into a plain array), so that many feature vectors can be scored with one
+            matrix product.
+        :return: void
+        """
+        self.wmat = ru.AsMatrix([self.w[c] for c in range(self.nclasses)])
+        self.cnstvec = ru.AsVector(self.cnst)
+        self.avgmat = ru.AsMatrix([self.classdope[c].average for c in range(self.nclasses)])
+        self.invmat = ru.AsMatrix(self.invavgcov)
 
     def sClassify(self, fv):
         """
@@ -184,38 +305,110 @@ class sClassifier:
         :param dp: value that indicates whether to calculate the distance from the class mean
         :return: sClassDope, ap, dp
         """
-        disc = [None for i in range(MAXSCLASSES)]
-
         if not self.w:
             raise Exception("sClassifyAD: {0} no trained classifier".format(self))
+        if self.wmat is None:
+            self.StackWeights()
 
-        for i in range(self.nclasses):
-            disc[i] = np.inner(self.w[i], fv) + self.cnst[i]
+        disc = np.dot(self.wmat, np.asarray(fv, dtype=np.float64)) + self.cnstvec
 
         # Find the class that has the smallest distance
-        maxclass = 0
-        for i in range(1, self.nclasses):
-            if disc[i] > disc[maxclass]:
-                maxclass = i
+        maxclass = int(np.argmax(disc))
 
         scd = self.classdope[maxclass]
 
         if ap:
             # Calculate probability of non ambiguity
-            denom = 0
-            for i in range(self.nclasses):
-                d = disc[i] - disc[maxclass]
-                # Quick check to avoid computing negligible term
-                if d > -7.0:
-                    denom += math.exp(d)
-            ap = 1.0 / denom
+            d = disc - disc[maxclass]
+            # Terms below -7.0 are negligible and left out
+            ap = 1.0 / float(np.sum(np.exp(d[d > -7.0])))
 
         if dp:
             # Calculate distance to mean of chosen class
-            dp = self.MahalanobisDistance(fv, scd.average, self.invavgcov)
+            with instrument.stage("mahalanobis"):
+                dp = self.ClassDistance(fv, maxclass)
 
         return scd, ap, dp
 
+    def sClassifyBatch(self, fvs):
+        """
+        Classify a batch of feature vectors at once, computing the rejection metrics for all of them.
+        :param fvs: (N, nfeatures) array of feature vectors
+        :return: array of class numbers, array of probabilities of unambiguous classification,
+            array of distances from the class means
+        """
+        if not self.w:
+            raise Exception("sClassifyBatch: {0} no trained classifier".format(self))
+        if self.wmat is None:
+            self.StackWeights()
+
+        fvs = np.atleast_2d(np.asarray(fvs, dtype=np.float64))
+        disc = np.dot(fvs, self.wmat.T) + self.cnstvec
+        classes = np.argmax(disc, axis=1)
+
+        # Probability of non ambiguity, terms below -7.0 are negligible and left out
+        d = disc - disc[np.arange(len(fvs)), classes][:, None]
+        ap = 1.0 / np.sum(np.where(d > -7.0, np.exp(d), 0.0), axis=1)
+
+        # Distance to the mean of the chosen class
+        dp = self.ClassDistances(fvs, classes)
+        return classes, ap, dp
+
+    def ClassDistances(self, fvs, classes):
+        """
+        Compute the Mahalanobis distances of a batch of feature vectors to the averages of their classes at once.
+        :param fvs: (N, nfeatures) array of feature vectors
+        :param classes: class number of every feature vector
+        :return: array of N distances
+        """
+        space = np.atleast_2d(np.asarray(fvs, dtype=np.float64)) - self.avgmat[classes]
+        if self.whiten is not None:
+            return np.sum(np.square(np.dot(space, self.whiten.T)), axis=1)
+        return np.sum(np.dot(space, self.invmat) * space, axis=1)
+
+    def ClassDistance(self, fv, c):
+        """
+        Compute the Mahalanobis distance between a feature vector and the average of a class, as the squared norm
+            of the whitened difference when the avg covariance matrix is factored.
+        :param fv: feature vector
+        :param c: class number
+        :return: distance
+        """
+        if self.whiten is None:
+            return self.MahalanobisDistance(fv, self.avgmat[c], self.invmat)
+        z = np.dot(self.whiten, np.asarray(fv, dtype=np.float64) - self.avgmat[c])
+        return float(np.dot(z, z))
+
+    def FactorStatistics(self):
+        """
+        Factor the avg covariance matrix of a classifier read with its training statistics, as sDoneAdding did, so
+            that sUpdate can continue training it.
+        :return: void
+        """
+        avgcov, denom = self.PooledCovariance()
+        if denom <= 0:
+            return
+        self.chol, self.featuremask = ru.PivotedCholesky(avgcov, EPS)
+        self.denom = denom
+        self.pending = []
+
+    def FactorInverse(self):
+        """
+        Factor the inverse avg covariance matrix of a classifier read from a file into the whitening matrix,
+            leaving out the features whose rows are zero. Without a factor (the matrix is not positive definite)
+            distances fall back to the quadratic form.
+        :return: void
+        """
+        self.chol = None
+        self.featuremask = np.any(self.invmat != 0.0, axis=1)
+        try:
+            c = np.linalg.cholesky(self.invmat[np.ix_(self.featuremask, self.featuremask)])
+        except np.linalg.LinAlgError:
+            self.whiten = None
+            return
+        self.whiten = np.zeros((len(c), self.nfeatures))
+        self.whiten[:, self.featuremask] = c.T
+
     def MahalanobisDistance(self, v, u, sigma):
         """
         Compute the Mahalanobis distance between two vectors v and u.
@@ -224,52 +417,50 @@ class sClassifier:
         :param sigma: inverse covariance matrix of class
         :return: distance
         """
-        if not self.space or len(self.space) != len(v):
-            self.space = [0 for i in range(len(v))]
-
-        for i in range(len(v)):
-            self.space[i] = v[i] - u[i]
+        space = np.asarray(v, dtype=np.float64) - np.asarray(u, dtype=np.float64)
+        return float(ru.QuadraticForm(space, np.asarray(sigma, dtype=np.float64)))
 
-        result = ru.QuadraticForm(self.space, sigma)
-        return result
-
-    def FixClassifier(self, avgcov):
+    def write(self, outfile):
         """
-        Handle the case of a singular average covariance matrix by removing features.
-        :param avgcov: singular average covariance matrix
+        Write a classifier to a file in the binary format, see BINARY_HEADER.
+        :param outfile: name of the output file
         :return: void
         """
-        bv = [0 for i in range(self.nfeatures)]
-        # Just add the features one by one, discarding any that cause the matrix to be non invertible
-        for i in range(self.nfeatures):
-            bv[i] = 1
-            m = ru.SliceMatrix(avgcov, bv, bv)
-            det = 0
-            try:
-                det = np.linalg.det(np.linalg.inv(np.matrix(m)))
-            except:
-                pass
-            if math.fabs(det) <= EPS:
-                bv[i] = 0
-
-        m = ru.SliceMatrix(avgcov, bv, bv)
-        r = np.linalg.inv(np.matrix(m))
-        det = 0
-        try:
-            det = np.linalg.det(r)
-        except:
-            pass
-        if math.fabs(det) <= EPS:
-            raise Exception("Can't fix classifier!")
-        self.invavgcov = ru.DeSliceMatrix(r, 0.0, bv, bv, self.invavgcov)
+        if self.wmat is None:
+            self.StackWeights()
+        names = b"\0".join(self.classdope[i].name.encode("utf-8") for i in range(self.nclasses))
+        # The training statistics are written when every class has them, so that training can be continued
+        statistics = self.nclasses > 0 and all(scd.nexamples > 0 for scd in self.classdope)
+        flags = BINARY_STATISTICS if statistics else 0
+        header = struct.pack(BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION, self.nclasses, self.nfeatures, flags,
+                             len(names))
+        padding = -(len(header) + len(names)) % BINARY_ALIGN
+
+        # Written next to outfile and moved into place: outfile may be memory-mapped by read, truncating it would
+        # pull the pages from under the mapped blocks
+        tmpfile = "{0}.{1}.tmp".format(outfile, os.getpid())
+        file = open(tmpfile, "wb")
+        file.write(header)
+        file.write(names)
+        file.write(b"\0" * padding)
+        for block in (self.avgmat, self.wmat, self.cnstvec, self.invmat):
+            file.write(np.ascontiguousarray(block, dtype="<f8").tobytes())
+        if statistics:
+            file.write(np.array([scd.nexamples for scd in self.classdope], dtype="<f8").tobytes())
+            for scd in self.classdope:
+                file.write(np.ascontiguousarray(scd.sumcov, dtype="<f8").tobytes())
+        file.close()
+        os.replace(tmpfile, outfile)
 
-    def write(self, outfile):
+    def writeText(self, outfile):
         """
-        Write a classifier to a file.
+        Write a classifier to a file in the legacy text format.
         :param outfile: name of the output file
         :return: void
         """
-        file = open(outfile, "w")
+        # Moved into place like in write, outfile may be memory-mapped by read
+        tmpfile = "{0}.{1}.tmp".format(outfile, os.getpid())
+        file = open(tmpfile, "w")
         file.write("{0} classes\n".format(self.nclasses))
         for i in range(self.nclasses):
             scd = self.classdope[i]
@@ -283,10 +474,87 @@ class sClassifier:
         file.write("{0}\n".format(ru.OutputVector(self.cnst)))
         file.write("{0}\n".format(ru.OutputMatrix(self.invavgcov)))
         file.close()
+        os.replace(tmpfile, outfile)
+
+    def read(self, infile, mmap=1):
+        """
+        Read a classifier from a file, in either the binary or the legacy text format.
+        :param infile: name of the input file
+        :param mmap: value that indicates whether a binary file is memory-mapped instead of copied into memory
+        :return: void
+        """
+        file = open(infile, "rb")
+        magic = file.read(len(BINARY_MAGIC))
+        file.close()
+        if magic == BINARY_MAGIC:
+            self.readBinary(infile, mmap)
+        else:
+            self.readText(infile)
 
-    def read(self, infile):
+    def readBinary(self, infile, mmap=1):
         """
-        Read a classifier from a file.
+        Read a classifier from a file in the binary format. When memory-mapped, the averages, weights, constants
+            and inverse covariance matrix are read-only views on the file, which are shared between processes.
+            Training statistics in the file are copied into memory, so that training can be continued.
+        :param infile: name of the input file
+        :param mmap: value that indicates whether the file is memory-mapped instead of copied into memory
+        :return: void
+        """
+        print("Reading classifier ")
+
+        file = open(infile, "rb")
+        header = file.read(struct.calcsize(BINARY_HEADER))
+        try:
+            magic, version, n, nfeatures, flags, namelen = struct.unpack(BINARY_HEADER, header)
+        except struct.error:
+            raise Exception("sRead 1")
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise Exception("sRead: unsupported classifier file {0}, version {1}".format(infile, version))
+        names = file.read(namelen).decode("utf-8").split("\0") if n else []
+        file.close()
+
+        offset = struct.calcsize(BINARY_HEADER) + namelen
+        offset += -offset % BINARY_ALIGN
+        size = 2 * n * nfeatures + n + nfeatures * nfeatures
+        if flags & BINARY_STATISTICS:
+            size += n + n * nfeatures * nfeatures
+        if mmap:
+            data = np.memmap(infile, dtype="<f8", mode="r", offset=offset, shape=(size,))
+        else:
+            data = np.fromfile(infile, dtype="<f8", count=size, offset=offset)
+        if len(data) != size:
+            raise Exception("sRead: truncated classifier file {0}".format(infile))
+
+        print("{0} classes ".format(n))
+        self.nfeatures = nfeatures
+        for i in range(n):
+            self.sAddClass(names[i])
+            print("{0}".format(names[i]))
+
+        blocks = np.split(data, np.cumsum([n * nfeatures, n * nfeatures, n, nfeatures * nfeatures, n]))
+        self.avgmat = blocks[0].reshape(n, nfeatures)
+        self.wmat = blocks[1].reshape(n, nfeatures)
+        self.cnstvec = blocks[2]
+        self.invmat = blocks[3].reshape(nfeatures, nfeatures)
+        for i in range(n):
+            self.classdope[i].average = self.avgmat[i]
+        self.w = [self.wmat[i] for i in range(n)]
+        self.cnst = self.cnstvec
+        self.invavgcov = self.invmat
+        self.FactorInverse()
+        if flags & BINARY_STATISTICS:
+            sumcov = blocks[5].reshape(n, nfeatures, nfeatures)
+            for i in range(n):
+                scd = self.classdope[i]
+                scd.nexamples = int(blocks[4][i])
+                scd.average = np.array(self.avgmat[i])
+                scd.sumcov = np.array(sumcov[i])
+            self.FactorStatistics()
+        print("\n")
+
+    def readText(self, infile):
+        """
+        Read a classifier from a file in the legacy text format.
         :param infile: name of the input file
         :return: void
         """
@@ -302,61 +570,93 @@ class sClassifier:
             raise Exception("sRead 1")
         print("{0} classes ".format(n))
         for i in range(n):
-            buf = file.readline()
-            scd = self.sAddClass(buf)
-            scd.name = buf
+            scd = self.sAddClass(file.readline().rstrip("\r\n"))
             print("{0}".format(scd.name))
 
         self.w = [None for i in range(self.nclasses)]
         for i in range(self.nclasses):
             scd = self.classdope[i]
-            scd.average = ru.InputVector(file.readline())
-            self.w[i] = ru.InputVector(file.readline())
-
-        self.cnst = ru.InputVector(file.readline())
-        self.invavgcov = ru.InputMatrix(file.readline())
+            scd.average = ru.AsVector(ru.InputVector(file.readline()))
+            self.w[i] = ru.AsVector(ru.InputVector(file.readline()))
+            self.nfeatures = len(scd.average)
+
+        self.cnst = ru.AsVector(ru.InputVector(file.readline()))
+        self.invavgcov = ru.AsMatrix(ru.InputMatrix(file.readline()))
+        self.StackWeights()
+        self.FactorInverse()
         print("\n")
         file.close()
 
+    def ClassDistanceMatrix(self):
+        """
+        Compute the Mahalanobis distances between the averages of all pairs of classes at once, from the Gram
+            matrix of the whitened averages: d(i, j) = g(i, i) + g(j, j) - 2 g(i, j).
+        :return: (nclasses, nclasses) symmetric array of distances
+        """
+        if self.wmat is None:
+            self.StackWeights()
+        if self.whiten is not None:
+            z = np.dot(self.avgmat, self.whiten.T)
+            gram = np.dot(z, z.T)
+        else:
+            gram = np.dot(np.dot(self.avgmat, self.invmat), self.avgmat.T)
+        norms = np.diag(gram)
+        d = np.maximum(norms[:, None] + norms[None, :] - 2 * gram, 0.0)
+        np.fill_diagonal(d, 0.0)
+        return d
+
+    def ConfusablePairs(self, nclosest):
+        """
+        Find the closest pairs of classes by a partial sort of the class distance matrix.
+        :param nclosest: number of pairs to find
+        :return: list of (class number, class number, distance), closest first
+        """
+        i, j = np.triu_indices(self.nclasses, 1)
+        d = self.ClassDistanceMatrix()[i, j]
+        nclosest = min(nclosest, len(d))
+        if nclosest <= 0:
+            return []
+        closest = np.argpartition(d, nclosest - 1)[:nclosest]
+        closest = closest[np.argsort(d[closest], kind="stable")]
+        return [(int(i[k]), int(j[k]), float(d[k])) for k in closest]
+
     def sDistances(self, nclosest):
         """
         compute pairwise distances between classes, and print the closest ones,
             as a clue as to which gesture classes are confusable.
-        :param nclosest: closest pairs of classes
-        :return:
+        :param nclosest: number of closest pairs of classes to print
+        :return: list of (class number, class number, distance), closest first
         """
-        d = [[None for i in range(self.nclasses)] for j in range(self.nclasses)]
-        min, max = 0, 0
-
         print("----------\n")
         print("{0} closest pairs of classes\n".format(nclosest))
-        for i in range(len(d)):
-            for j in range(i+1, len(d[i])):
-                d[i][j] = self.MahalanobisDistance(
-                    self.classdope[i].average,
-                    self.classdope[j].average,
-                    self.invavgcov)
-            if d[i][j] > max:
-                max = d[i][j]
-
-        for n in range(1, len(nclosest)):
-            min = max
-            mi, mj = -1, -1
-            for i in range(len(d)):
-                for j in range(i+1, len(d[i])):
-                    if d[i][j] < min:
-                        mi, mj = i, j
-                        min = d[mi][mj]
-            if mi == 1:
-                break
-
+        pairs = self.ConfusablePairs(nclosest)
+        for n, (i, j, d) in enumerate(pairs):
             print("{0}) {1} to {2} d= {3} nstd={4}\n".format(
-                  n,
-                  self.classdope[mi].name,
-                  self.classdope[mj].name,
-                  d[mi][mj],
-                  math.sqrt(d[mi][mj])))
-
-            d[mi][mj] = max + 1
+                  n + 1,
+                  self.classdope[i].name,
+                  self.classdope[j].name,
+                  d,
+                  math.sqrt(d)))
 
         print("----------\n")
+        return pairs
+
+
+def ConvertClassifier(infile, outfile):
+    """
+    Convert a classifier in the legacy text format to the binary format.
+    :param infile: name of the legacy text file
+    :param outfile: name of the binary output file
+    :return: the converted classifier
+    """
+    classifier = sClassifier()
+    classifier.readText(infile)
+    classifier.write(outfile)
+    return classifier
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python sc.py <legacy classifier file> <binary classifier file>")
+        sys.exit(1)
+    ConvertClassifier(sys.argv[1], sys.argv[2])
@@ -1,11 +1,14 @@
 import sc
 import fv_example
+import corpus
 
 NEXAMPLES = 15
 
 
 def take_input():
-    pass
+    # Read a gesture from a file with one "x y time" point per line
+    print("Enter gesture file: ")
+    return corpus.read_gesture(str(input()))
 
 
 def MakeAClassifier():
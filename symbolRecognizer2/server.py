@@ -0,0 +1,243 @@
+"""
+Asyncio gesture recognition server. Clients connect over TCP or a Unix socket and send newline-delimited JSON:
+
+    {"id": 1, "points": [[x, y, t], ...]}    ->  {"id": 1, "class": "...", "ap": ..., "dp": ..., "latency_ms": ...}
+    {"id": 2, "cmd": "stats"}                ->  {"id": 2, "stats": {...}}
+    {"id": 3, "cmd": "metrics"}              ->  {"id": 3, "metrics": {...}}        (with --instrument)
+    {"id": 4, "cmd": "prometheus"}           ->  {"id": 4, "prometheus": "..."}     (with --instrument)
+
+Concurrent requests, from one or many clients, are micro-batched: the batcher waits at most max_wait seconds for
+up to max_batch gestures, featurizes them with fv.RaggedFv and classifies them with one
+sClassifier.sClassifyBatch call.
+
+Usage: python server.py classifier.out [--host HOST] [--port PORT | --unix PATH] [--max-batch N] [--max-wait-ms MS]
+                                      [--instrument]
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+import numpy as np
+import fv
+import instrument
+import sc
+
+MAX_BATCH = 64
+MAX_WAIT = 0.002
+# Number of most recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 10000
+# Longest request line in bytes, a gesture of 3000 points takes about 100 KB of JSON
+LINE_LIMIT = 16 * 1024 * 1024
+# Fewest points of a gesture that can be classified
+MIN_POINTS = 2
+
+
+class GestureServer:
+    """
+    Server that classifies the gestures sent by its clients in micro-batches.
+    """
+
+    def __init__(self, classifier, max_batch=MAX_BATCH, max_wait=MAX_WAIT, line_limit=LINE_LIMIT):
+        self.classifier = classifier
+        self.line_limit = line_limit
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.batcher = None
+        # Latency of every request, from receiving it to having its result, in seconds
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.nrequests = 0
+        self.nbatches = 0
+
+    async def classify(self, points):
+        """
+        Queue a gesture for the next batch and wait for its classification.
+        :param points: (n, 3) array of (x, y, time) points
+        :return: class name, probability of unambiguous classification, distance from the class mean
+        """
+        if self.batcher is None:
+            self.batcher = asyncio.get_running_loop().create_task(self.batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((points, future, time.perf_counter()))
+        return await future
+
+    async def batch_loop(self):
+        """
+        Collect queued gestures into batches of at most max_batch, waiting at most max_wait for a batch to fill.
+        :return: void
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        """
+        Featurize and classify a batch of queued gestures, and resolve their futures.
+        :param batch: list of (points, future, time received)
+        :return: void
+        """
+        points = np.concatenate([p for p, f, t in batch])
+        offsets = np.cumsum([0] + [len(p) for p, f, t in batch])
+        instrument.observe("batch_size", len(batch))
+        try:
+            with instrument.stage("featurize_batch"):
+                fvs = fv.RaggedFv(points[:, 0], points[:, 1], points[:, 2], offsets)
+            with instrument.stage("classify_batch"):
+                classes, ap, dp = self.classifier.sClassifyBatch(fvs)
+        except Exception as e:
+            for p, future, t in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        done = time.perf_counter()
+        self.nbatches += 1
+        for i, (p, future, received) in enumerate(batch):
+            self.nrequests += 1
+            self.latencies.append(done - received)
+            instrument.timed("request", done - received)
+            if not future.done():
+                future.set_result((self.classifier.classdope[classes[i]].name, float(ap[i]), float(dp[i])))
+
+    def stats(self):
+        """
+        Latency percentiles and counters of the server.
+        :return: dict of statistics, latencies in milliseconds
+        """
+        stats = {"requests": self.nrequests, "batches": self.nbatches,
+                 "mean_batch": self.nrequests / self.nbatches if self.nbatches else 0.0}
+        if self.latencies:
+            p50, p90, p99 = np.percentile(np.array(self.latencies) * 1000, [50, 90, 99])
+            stats.update({"p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "max_ms": max(self.latencies) * 1000})
+        return stats
+
+    async def handle_request(self, line, writer):
+        """
+        Answer a single request line.
+        :param line: JSON encoded request
+        :param writer: asyncio stream writer of the client
+        :return: void
+        """
+        received = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("cmd") == "stats":
+                response = {"id": request_id, "stats": self.stats()}
+            elif request.get("cmd") == "metrics":
+                response = {"id": request_id, "metrics": instrument.snapshot()}
+            elif request.get("cmd") == "prometheus":
+                response = {"id": request_id, "prometheus": instrument.prometheus()}
+            else:
+                points = np.asarray(request["points"], dtype=np.float64).reshape(-1, 3)
+                if len(points) < MIN_POINTS:
+                    raise Exception("a gesture needs at least {0} points".format(MIN_POINTS))
+                name, ap, dp = await self.classify(points)
+                response = {"id": request_id, "class": name, "ap": ap, "dp": dp,
+                            "latency_ms": (time.perf_counter() - received) * 1000}
+        except Exception as e:
+            response = {"id": request_id, "error": "{0}".format(e)}
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        # Wait for a slow client to read, instead of buffering its responses without bound
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handle_client(self, reader, writer):
+        """
+        Serve one client connection. Requests are answered as soon as their batch is done, so a client may
+            pipeline many requests and receive the responses out of order.
+        :param reader: asyncio stream reader of the client
+        :param writer: asyncio stream writer of the client
+        :return: void
+        """
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # The rest of the line cannot be told apart from the next request, so the connection is closed
+                    response = {"id": None, "error": "request longer than {0} bytes".format(self.line_limit)}
+                    writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(self.handle_request(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down, returning instead of raising keeps asyncio from logging a traceback
+            for task in pending:
+                task.cancel()
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix=None):
+        """
+        Run the server until it is cancelled.
+        :param host: host to listen on over TCP
+        :param port: port to listen on over TCP
+        :param unix: path of a Unix socket to listen on instead of TCP
+        :return: void
+        """
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix, limit=self.line_limit)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port, limit=self.line_limit)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.batcher is not None:
+                self.batcher.cancel()
+                self.batcher = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gesture recognition server")
+    parser.add_argument("classifier", help="classifier file, binary or legacy text")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT * 1000)
+    parser.add_argument("--instrument", action="store_true", help="collect per stage timers and histograms")
+    args = parser.parse_args()
+
+    if args.instrument:
+        instrument.enable()
+    classifier = sc.sClassifier()
+    classifier.read(args.classifier)
+    server = GestureServer(classifier, args.max_batch, args.max_wait_ms / 1000)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
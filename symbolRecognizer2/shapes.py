@@ -0,0 +1,548 @@
+"""
+Filters that classify hand drawn shapes (circles, lines, triangles, diamonds, rectangles and ellipses)
+from the geometry of a gesture, independent of any user interface.
+"""
+import math
+import time
+from collections import deque
+import numpy as np
+import geometry
+import instrument
+
+# Bounds on the history of classified gestures, the oldest gestures are evicted first
+HISTORY_GESTURES = 100
+HISTORY_POINTS = 50000
+
+
+class Gesture:
+    """
+    A completed gesture together with the cached results of its filters and its label.
+    """
+
+    def __init__(self, geometry, strokes):
+        self.geometry = geometry
+        self.strokes = strokes
+        self.ar_ac = None
+        self.ar_per = None
+        self.r_e = None
+        self.label = None
+        # Features computed by the filter cascade so far, by name
+        self.features = {}
+
+
+class GestureHistory:
+    """
+    Bounded store of past gestures, evicting the oldest ones when there are too many gestures or points.
+    """
+
+    def __init__(self, max_gestures=HISTORY_GESTURES, max_points=HISTORY_POINTS):
+        self.max_gestures = max_gestures
+        self.max_points = max_points
+        self.gestures = deque()
+        self.npoints = 0
+
+    def add(self, gesture):
+        """
+        Add a gesture, evicting old gestures if the history grows past its bounds.
+        :param gesture: Gesture to add
+        :return: void
+        """
+        self.gestures.append(gesture)
+        self.npoints += gesture.geometry.npoints
+        while len(self.gestures) > 1 and (len(self.gestures) > self.max_gestures or self.npoints > self.max_points):
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the oldest gesture from the history.
+        :return: the removed Gesture
+        """
+        gesture = self.gestures.popleft()
+        self.npoints -= gesture.geometry.npoints
+        return gesture
+
+    def clear(self):
+        """
+        Remove all gestures from the history.
+        :return: void
+        """
+        self.gestures.clear()
+        self.npoints = 0
+
+    def __len__(self):
+        return len(self.gestures)
+
+    def __iter__(self):
+        return iter(self.gestures)
+
+
+def calc_perimeter(points):
+    """
+    Calculate the perimeter of a sketch defined by points.
+    :param points: aray of points [(xi, yi)]
+    :return: perimeter of the sketch defined by points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(len(points), -1)
+    if len(points) < 2:
+        return 0
+    return float(np.sum(np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1]))))
+
+
+def calc_area(points):
+    """
+    Function implements Shoelace method to calculate area of a polygon.
+    Source of code: https://stackoverflow.com/a/53864271/11482532
+    :param points: aray of points [(xi, yi)]
+    :return: area of the polygon defined by the given points
+    """
+    x = np.array([p[0] for p in points])
+    y = np.array([p[1] for p in points])
+    x_ = x - x.mean()
+    y_ = y - y.mean()
+    # Correction term is introduced to allow for more performant code.
+    # For complete reasoning and source of the code see https://stackoverflow.com/a/53864271/11482532
+    correction = x_[-1] * y_[0] - y_[-1] * x_[0]
+    area = np.dot(x_[:-1], y_[1:]) - np.dot(y_[:-1], x_[1:])
+    return 0.5 * np.abs(area + correction)
+
+
+def area_ratio_filter(x, y, Ac):
+    """
+    Filter that looks at the ratio of the area defined by the convex hull and the bounding box.
+    :param x: X coordinates of the convex hull, smallest and largest value are used to determine bounding box
+    :param y: y coordinates of the convex hull, smallest and largest value are used to determine bounding box
+    :param Ac: area of the convex hull
+    :return: Return ratio.
+    """
+    bbox_points = np.array([(np.min(x), np.min(y)), (np.min(x), np.max(y)),
+                            (np.max(x), np.max(y)), (np.max(x), np.min(y))])
+    Ar = calc_area(bbox_points)
+    ratio = Ac / Ar
+    return ratio
+
+
+def triangle_diamond_filter(segments):
+    """
+    Distinguish between triangle or diamond shapes.
+    :param segments: segments of the current shape
+    :return: number of corners found
+    """
+    # Find corners of sketch, comparing the direction of every segment with the next one in a single pass
+    offsets = np.cumsum([0] + [len(seg) for seg in segments])
+    xy = np.array([p[:2] for seg in segments for p in seg], dtype=np.float64).reshape(-1, 2)
+    return len(geometry.find_corners(xy[:, 0], xy[:, 1], offsets))
+
+
+def degenerate(area, bbox):
+    """
+    Test whether the filter ratios of a shape are undefined, because it has no area, width or height (e.g. a click,
+    or a horizontal or vertical line).
+    :param area: area of the shape
+    :param bbox: bounding rectangle
+    :return: whether the shape is degenerate
+    """
+    return not (area > 0 and bbox[1] - bbox[0] > 0 and bbox[3] - bbox[2] > 0)
+
+
+def area_perimeter_candidates(bbox):
+    """
+    Theoretical ratios between the squared perimeter and the area of the basic shapes with the aspect ratio of a
+    bounding rectangle. They only depend on the bounding rectangle, not on the hull.
+    :param bbox: bounding rectangle
+    :return: list of (ratio, bool) for diamonds, rectangles, triangles and circles, bool as in area_perimeter_ratio
+    """
+    w = bbox[1] - bbox[0]
+    h = bbox[3] - bbox[2]
+    s = w / h
+    p_d = 8 * (math.pow(s, 2) + 1) / math.pow(s, 2)  # For diamonds
+    p_r = 4 * (s + 2 + (1 / s))  # For rectangles
+    p_t = 2 * math.pow((s + math.sqrt(math.pow(s, 2) + 4)), 2)  # For triangles
+    K = 0.005095 * math.pow(s, 4) - 0.0693346 * math.pow(s, 3) + 0.346653 * s - 0.519223 * math.pow(s, 2) + 0.24308
+    p_e = math.pi * ((s + 1) / 2) - K  # For circles
+    return [(p_d, -1), (p_r, 0), (p_t, -1), (p_e, 1)]
+
+
+def area_perimeter_ratio(area, perimeter, bbox, candidates=None):
+    """
+    Distinguish between basic shapes based on the ratio between the perimeter and area of the shape.
+    :param area: area of the shape
+    :param perimeter: perimeter of the shape
+    :param bbox: bounding rectangle
+    :param candidates: area_perimeter_candidates(bbox), calculated if not given
+    :return: (ratio, bool) where ratio is the value of the ratio that gives the smallest difference and bool denotes
+    whether the ratio of the input is closer to the theoretical ratio of a rectangle (1) or closer to that of elipse (0), -1 in other cases
+    """
+    # Ratio of the input shape
+    p_in = math.pow(perimeter, 2) / area
+    if candidates is None:
+        candidates = area_perimeter_candidates(bbox)
+    to_ret = (0, -1)
+    min_val = math.inf
+    for p, r_e in candidates:
+        if math.fabs(p_in - p) < min_val:
+            min_val = math.fabs(p_in - p)
+            to_ret = p, r_e
+    return to_ret
+
+
+def apply_filters(ar_per, ar_ac, s, r_e):
+    """
+    Apply the results of the filers.
+    :param ar_per: area perimeter ratio
+    :param ar_ac: ratio of the area defined by the convex hull and the bounding box
+    :param s: segments from the gesture
+    :param r_e: boolean from the area-perimeter filter that denotes the shape is a rectangle or ellipse
+    :return: label of the shape
+    """
+    # Order of filtering
+    if 3 * math.pi <= ar_per <= 5 * math.pi:
+        # Circle
+        return "Circle"
+    elif 35 <= ar_per < 55:
+        # Undefined shape
+        return "Unknown shape"
+    elif 55 <= ar_per < 75:
+        # Line
+        return "Line"
+    elif 0.35 <= ar_ac < 0.7:
+        # Triangle/diamond
+        ans = triangle_diamond_filter(s)
+        if ans == 3:
+            return "Triangle"
+        elif ans == 4:
+            return "Diamond"
+        else:
+            return "Unknown shape"
+    elif 0.8 <= ar_ac <= 1 or r_e:
+        # Rectangle
+        return "Rectangle"
+    else:
+        # Elipse
+        return "Elipse"
+
+
+def batch_features(x, y, offsets, stroke_offsets=None):
+    """
+    Calculate the filter features of every gesture of a ragged batch at once, with one reduction per feature over
+    the concatenated points instead of one pass per gesture.
+    :param x: concatenated x-coordinates of all gestures
+    :param y: concatenated y-coordinates of all gestures
+    :param offsets: start index of every gesture, followed by the total number of points
+    :param stroke_offsets: start index of every stroke, followed by the total number of points, every gesture
+    being one stroke if not given
+    :return: dict of arrays with one value per gesture: "area", "perimeter" (of the convex hull), "bbox"
+    (min x, max x, min y, max y per row), "ar_ac", "ar_per", "r_e" and "corners", nan for empty gestures and
+    nan ratios for gestures without area, width or height
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)[offsets[0]:offsets[-1]]
+    y = np.asarray(y, dtype=np.float64)[offsets[0]:offsets[-1]]
+    stroke_offsets = offsets if stroke_offsets is None else np.asarray(stroke_offsets, dtype=np.int64)
+    # Every gesture boundary is a stroke boundary as well
+    stroke_offsets = np.union1d(stroke_offsets, offsets) - offsets[0]
+    offsets = offsets - offsets[0]
+    counts = np.diff(offsets)
+    ngestures = len(counts)
+    features = {name: np.full(ngestures, np.nan) for name in ("area", "perimeter", "ar_ac", "ar_per", "r_e",
+                                                              "corners")}
+    features["bbox"] = np.full((ngestures, 4), np.nan)
+    nonempty = counts > 0
+    if not np.any(nonempty):
+        return features
+    # Empty gestures are skipped, so that every slice of reduceat is exactly one gesture
+    starts = offsets[:-1][nonempty]
+    n = counts[nonempty]
+
+    # Shoelace area of all points, strokes joined, relative to the first point of the gesture so that the closing
+    # term vanishes, and without the cross terms between the last point of a gesture and the first of the next
+    dx = x - np.repeat(x[starts], n)
+    dy = y - np.repeat(y[starts], n)
+    cross = np.zeros(len(x))
+    cross[:-1] = dx[:-1] * dy[1:] - dy[:-1] * dx[1:]
+    cross[offsets[1:][nonempty] - 1] = 0.0
+    area = 0.5 * np.abs(np.add.reduceat(cross, starts))
+
+    xmin = np.minimum.reduceat(x, starts)
+    xmax = np.maximum.reduceat(x, starts)
+    ymin = np.minimum.reduceat(y, starts)
+    ymax = np.maximum.reduceat(y, starts)
+    perimeter = geometry.hull_perimeters(x, y, offsets)[nonempty]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # area_ratio_filter: the bounding box of the hull is that of the points
+        ar_ac = area / ((xmax - xmin) * (ymax - ymin))
+        # area_perimeter_ratio for all gestures: the theoretical ratio closest to that of the gesture
+        p_in = perimeter ** 2 / area
+        s = (xmax - xmin) / (ymax - ymin)
+        K = 0.005095 * s ** 4 - 0.0693346 * s ** 3 + 0.346653 * s - 0.519223 * s ** 2 + 0.24308
+        ratios = np.column_stack((8 * (s ** 2 + 1) / s ** 2, 4 * (s + 2 + (1 / s)),
+                                  2 * (s + np.sqrt(s ** 2 + 4)) ** 2, np.pi * ((s + 1) / 2) - K))
+        closest = np.argmin(np.abs(p_in[:, None] - ratios), axis=1)
+    ar_per = ratios[np.arange(len(ratios)), closest]
+    r_e = np.array([-1, 0, -1, 1])[closest].astype(np.float64)
+    # Where area_perimeter_ratio divides by zero the ratios are undefined
+    undefined = (area == 0) | (xmax == xmin) | (ymax == ymin)
+    ar_ac[undefined] = np.nan
+    ar_per[undefined] = np.nan
+    r_e[undefined] = np.nan
+
+    # triangle_diamond_filter for all gestures: corners between consecutive strokes, the last stroke of a gesture
+    # being followed by its first
+    theta = geometry.segment_directions(x, y, stroke_offsets)
+    first_stroke = np.searchsorted(stroke_offsets, offsets)
+    nstrokes = np.diff(first_stroke)
+    following = np.arange(1, len(theta) + 1)
+    following[first_stroke[1:][nonempty] - 1] = first_stroke[:-1][nonempty]
+    turn = np.abs(theta[following] - theta) % np.pi
+    turn = np.minimum(turn, np.pi - turn)
+    with np.errstate(invalid="ignore"):
+        corner = turn > geometry.CORNER_ANGLE
+    corners = np.add.reduceat(corner.astype(np.int64), first_stroke[:-1][nonempty])
+    corners[nstrokes[nonempty] == 0] = 0
+
+    features["area"][nonempty] = area
+    features["perimeter"][nonempty] = perimeter
+    features["bbox"][nonempty] = np.column_stack((xmin, xmax, ymin, ymax))
+    features["ar_ac"][nonempty] = ar_ac
+    features["ar_per"][nonempty] = ar_per
+    features["r_e"][nonempty] = r_e
+    features["corners"][nonempty] = corners
+    return features
+
+
+def classify_batch(x, y, offsets, stroke_offsets=None):
+    """
+    Classify every gesture of a ragged batch at once, with the rules of apply_filters applied to the arrays of
+    batch_features. Gestures whose ratios are undefined (no points, no area, or no width or height) are labeled
+    "Unknown shape".
+    :param x: concatenated x-coordinates of all gestures
+    :param y: concatenated y-coordinates of all gestures
+    :param offsets: start index of every gesture, followed by the total number of points
+    :param stroke_offsets: start index of every stroke, followed by the total number of points, every gesture
+    being one stroke if not given
+    :return: list of the label of every gesture
+    """
+    f = batch_features(x, y, offsets, stroke_offsets)
+    ar_per, ar_ac, corners = f["ar_per"], f["ar_ac"], f["corners"]
+    defined = ~np.isnan(ar_per)
+    triangle_diamond = (0.35 <= ar_ac) & (ar_ac < 0.7)
+    labels = np.select(
+        [~defined,
+         (3 * math.pi <= ar_per) & (ar_per <= 5 * math.pi),
+         (35 <= ar_per) & (ar_per < 55),
+         (55 <= ar_per) & (ar_per < 75),
+         triangle_diamond & (corners == 3),
+         triangle_diamond & (corners == 4),
+         triangle_diamond,
+         (f["r_e"] != 0) | ((0.8 <= ar_ac) & (ar_ac <= 1))],
+        ["Unknown shape", "Circle", "Unknown shape", "Line", "Triangle", "Diamond", "Unknown shape", "Rectangle"],
+        "Elipse")
+    return labels.tolist()
+
+
+class Feature:
+    """
+    A feature of a gesture read by the rules of a FilterCascade, with the number of times it was computed and the
+    total time spent on it, including the features it reads the first time they are read.
+    """
+
+    def __init__(self, name, function):
+        # function(gesture, features) computes the feature, reading other features through features[name]
+        self.name = name
+        self.function = function
+        self.calls = 0
+        self.seconds = 0.0
+
+
+class Rule:
+    """
+    A stage of a FilterCascade, with the number of gestures it was evaluated on and the number it labeled.
+    """
+
+    def __init__(self, name, test):
+        # test(features) returns the label of the gesture, or None to pass it on to the next rule
+        self.name = name
+        self.test = test
+        self.evaluated = 0
+        self.fired = 0
+        self.seconds = 0.0
+
+
+class LazyFeatures:
+    """
+    The features of one gesture, every feature computed the first time a rule reads it and memoized in the gesture.
+    """
+
+    def __init__(self, cascade, gesture):
+        self.cascade = cascade
+        self.gesture = gesture
+
+    def __getitem__(self, name):
+        memo = self.gesture.features
+        if name not in memo:
+            feature = self.cascade.features[name]
+            start = time.perf_counter()
+            memo[name] = feature.function(self.gesture, self)
+            seconds = time.perf_counter() - start
+            feature.calls += 1
+            feature.seconds += seconds
+            instrument.timed("shape_" + name, seconds)
+        return memo[name]
+
+
+class FilterCascade:
+    """
+    Ordered rules that label a gesture, the first rule returning a label wins. The features the rules read are
+    computed lazily and memoized per gesture, so a gesture only pays for the features on its own decision path,
+    and rules reading cheap features should come first. The time spent in every feature and rule is accounted
+    for, see costs().
+    """
+
+    def __init__(self, features=(), rules=()):
+        self.features = {}
+        self.rules = []
+        for feature in features:
+            self.add_feature(*feature)
+        for rule in rules:
+            self.add_rule(*rule)
+
+    def add_feature(self, name, function):
+        """
+        Add a feature, or replace the feature with the same name.
+        :param name: name of the feature
+        :param function: function(gesture, features) computing the feature
+        :return: void
+        """
+        self.features[name] = Feature(name, function)
+
+    def add_rule(self, name, test, before=None):
+        """
+        Add a rule, or replace the rule with the same name in place.
+        :param name: name of the rule
+        :param test: function(features) returning a label or None
+        :param before: name of the rule to insert the new rule before, appended at the end if not given
+        :return: void
+        """
+        names = [rule.name for rule in self.rules]
+        if name in names:
+            self.rules[names.index(name)] = Rule(name, test)
+        elif before is None:
+            self.rules.append(Rule(name, test))
+        else:
+            if before not in names:
+                raise Exception("add_rule: no rule {0}".format(before))
+            self.rules.insert(names.index(before), Rule(name, test))
+
+    def reorder(self, names):
+        """
+        Change the order of the rules.
+        :param names: names of all rules, in their new order
+        :return: void
+        """
+        rules = {rule.name: rule for rule in self.rules}
+        if sorted(names) != sorted(rules):
+            raise Exception("reorder: expected the rules {0}".format(", ".join(sorted(rules))))
+        self.rules = [rules[name] for name in names]
+
+    def classify(self, gesture):
+        """
+        Label a gesture with the first rule that returns a label, computing only the features the rules read.
+        :param gesture: Gesture to classify, its memoized features are kept and extended
+        :return: label of the shape, None if no rule returned one
+        """
+        features = LazyFeatures(self, gesture)
+        for rule in self.rules:
+            start = time.perf_counter()
+            label = rule.test(features)
+            rule.seconds += time.perf_counter() - start
+            rule.evaluated += 1
+            if label is not None:
+                rule.fired += 1
+                return label
+        return None
+
+    def costs(self):
+        """
+        :return: dict with a dict per feature of its calls and seconds, and a dict per rule of the number of
+        gestures it was evaluated on and labeled, and its seconds including the features it computed
+        """
+        return {"features": {f.name: {"calls": f.calls, "seconds": f.seconds} for f in self.features.values()},
+                "rules": {r.name: {"evaluated": r.evaluated, "fired": r.fired, "seconds": r.seconds}
+                          for r in self.rules}}
+
+    def reset_costs(self):
+        for item in list(self.features.values()) + self.rules:
+            item.seconds = 0.0
+        for feature in self.features.values():
+            feature.calls = 0
+        for rule in self.rules:
+            rule.evaluated = 0
+            rule.fired = 0
+
+
+def triangle_or_diamond(corners):
+    if corners == 3:
+        return "Triangle"
+    elif corners == 4:
+        return "Diamond"
+    return "Unknown shape"
+
+
+def ar_per_between(f, low, high, closed=False):
+    """
+    Test whether the area perimeter ratio lies in a range. The ratio is always one of the candidates of the bounding
+    box, so when none of them lies in the range the hull is not needed.
+    :param f: features of the gesture
+    :param low: lower bound, included
+    :param high: upper bound, included if closed
+    :return: whether the ratio lies in the range
+    """
+    def inside(ratio):
+        return low <= ratio <= high if closed else low <= ratio < high
+
+    if not any(inside(ratio) for ratio, r_e in f["candidates"]):
+        return False
+    return inside(f["ar_per"])
+
+
+# The filters of apply_filters, in the same order and with the same outcome. Every rule reads the features that
+# do not need the hull first: the area and bounding box are kept up to date while the gesture is drawn, so the
+# candidate ratios and ar_ac are cheap. The hull (for ar_per and r_e) is only computed when those cannot decide.
+CASCADE = FilterCascade(
+    features=[
+        ("degenerate", lambda g, f: degenerate(g.geometry.area, g.geometry.bbox)),
+        ("candidates", lambda g, f: area_perimeter_candidates(g.geometry.bbox)),
+        # area_ratio_filter of the hull, whose bounding box is that of the gesture
+        ("ar_ac", lambda g, f: np.float64(g.geometry.area) / ((g.geometry.bbox[1] - g.geometry.bbox[0]) *
+                                                              (g.geometry.bbox[3] - g.geometry.bbox[2]))),
+        ("area_perimeter", lambda g, f: area_perimeter_ratio(g.geometry.area, g.geometry.hull_perimeter,
+                                                             g.geometry.bbox, f["candidates"])),
+        ("ar_per", lambda g, f: f["area_perimeter"][0]),
+        ("r_e", lambda g, f: f["area_perimeter"][1]),
+        ("corners", lambda g, f: triangle_diamond_filter(g.strokes)),
+    ],
+    rules=[
+        # The ratios divide by the area, width and height, like classify_batch such shapes are unknown
+        ("degenerate", lambda f: "Unknown shape" if f["degenerate"] else None),
+        ("circle", lambda f: "Circle" if ar_per_between(f, 3 * math.pi, 5 * math.pi, closed=True) else None),
+        ("unknown", lambda f: "Unknown shape" if ar_per_between(f, 35, 55) else None),
+        ("line", lambda f: "Line" if ar_per_between(f, 55, 75) else None),
+        ("triangle_diamond", lambda f: triangle_or_diamond(f["corners"]) if 0.35 <= f["ar_ac"] < 0.7 else None),
+        ("rectangle", lambda f: "Rectangle" if 0.8 <= f["ar_ac"] <= 1 or f["r_e"] else None),
+        ("ellipse", lambda f: "Elipse"),
+    ])
+
+
+def classify_gesture(gesture, cascade=None):
+    """
+    Classify a completed gesture with a filter cascade, caching the features it computed in the gesture.
+    :param gesture: Gesture to classify
+    :param cascade: FilterCascade to classify with, CASCADE if not given
+    :return: label of the shape
+    """
+    cascade = CASCADE if cascade is None else cascade
+    gesture.label = cascade.classify(gesture)
+    gesture.ar_ac = gesture.features.get("ar_ac")
+    gesture.ar_per = gesture.features.get("ar_per")
+    gesture.r_e = gesture.features.get("r_e")
+    return gesture.label
@@ -0,0 +1,30 @@
+"""
+Shapes without area, width or height get the same label one at a time through the engine as in a batch.
+"""
+import numpy as np
+import engine
+import shapes
+
+
+def classify(points):
+    """
+    Classify one stroke both through the engine and with classify_batch.
+    :param points: list of raw points [(xi, yi)]
+    :return: (label of the engine, label of classify_batch)
+    """
+    recognition = engine.RecognitionEngine()
+    recognition.start_stroke()
+    for i, (x, y) in enumerate(points):
+        recognition.add_point(x, y, i)
+    recognition.finish_stroke()
+    label = recognition.classify_gesture(recognition.take_gesture())
+    xy = np.array(points, dtype=np.float64)
+    return label, shapes.classify_batch(xy[:, 0], xy[:, 1], [0, len(xy)])[0]
+
+
+def test_click():
+    assert classify([(10, 10)]) == ("Unknown shape", "Unknown shape")
+
+
+def test_horizontal_line():
+    assert classify([(x, 50) for x in range(0, 200, 3)]) == ("Unknown shape", "Unknown shape")
@@ -0,0 +1,211 @@
+"""
+Train and evaluate a classifier on a labeled gesture corpus on disk, in parallel over a process pool.
+
+A corpus is either a directory with one subdirectory per class, named after the class, where every file holds one
+gesture with one "x y time" point per line, or a columnar gesture store (see corpus.py). The gestures are sharded
+over the worker processes, every worker featurizes its shard and returns per class statistics (number of examples,
+mean and scatter matrix), and those are merged exactly into one classifier before sDoneAdding.
+
+Usage: python train.py <corpus or store> <classifier file> [--workers N] [--evaluate <test corpus or store>]
+                       [--closest N]
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import corpus
+import fv
+import sc
+
+SHARD_SIZE = 1000
+
+
+def shards(items, size):
+    """
+    Split a list in consecutive shards.
+    :param items: list to split
+    :param size: maximum number of items per shard
+    :return: list of shards
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def featurize(gestures):
+    """
+    Featurize a list of gestures in one batch.
+    :param gestures: list of (n, 3) point arrays
+    :return: (len(gestures), NFEATURES) array of feature vectors
+    """
+    if not gestures:
+        return np.zeros((0, fv.NFEATURES))
+    points = np.concatenate(gestures)
+    offsets = np.cumsum([0] + [len(g) for g in gestures])
+    return fv.RaggedFv(points[:, 0], points[:, 1], points[:, 2], offsets)
+
+
+def class_statistics(labels, features):
+    """
+    Calculate the sufficient statistics of every class in a set of labeled feature vectors.
+    :param labels: class name of every feature vector
+    :param features: (n, NFEATURES) array of feature vectors
+    :return: dict of class name to (number of examples, mean, scatter matrix)
+    """
+    labels = np.asarray(labels)
+    stats = {}
+    for classname in np.unique(labels):
+        ys = features[labels == classname]
+        average = ys.mean(axis=0)
+        space = ys - average
+        stats[str(classname)] = (len(ys), average, np.dot(space.T, space))
+    return stats
+
+
+def shard_statistics(shard):
+    """
+    Worker: read and featurize a shard of gesture files, and return the statistics of every class in it.
+    :param shard: list of (class name, file name)
+    :return: dict of class name to (number of examples, mean, scatter matrix)
+    """
+    features = featurize([corpus.read_gesture(path) for classname, path in shard])
+    return class_statistics([classname for classname, path in shard], features)
+
+
+def store_shard_statistics(task):
+    """
+    Worker: featurize a range of gestures of a store, and return the statistics of every class in it.
+    :param task: (store directory, index of the first gesture, index after the last gesture)
+    :return: dict of class name to (number of examples, mean, scatter matrix)
+    """
+    directory, start, stop = task
+    store = corpus.GestureStore(directory)
+    return class_statistics([store.label(i) for i in range(start, stop)], store.features(start, stop))
+
+
+def store_shards(directory, size):
+    """
+    Split a store in consecutive ranges of gestures.
+    :param directory: store directory
+    :param size: maximum number of gestures per range
+    :return: list of (store directory, index of the first gesture, index after the last gesture)
+    """
+    n = len(corpus.GestureStore(directory))
+    return [(directory, i, min(i + size, n)) for i in range(0, n, size)]
+
+
+def merge_statistics(classifier, partials):
+    """
+    Merge per class statistics into a classifier, adding the classes in sorted order.
+    :param classifier: sClassifier to add the statistics to
+    :param partials: list of dicts of class name to (number of examples, mean, scatter matrix)
+    :return: void
+    """
+    for classname in sorted(set(name for partial in partials for name in partial)):
+        for partial in partials:
+            if classname in partial:
+                n, average, sumcov = partial[classname]
+                classifier.sAddStatistics(classname, n, average, sumcov)
+
+
+def train_corpus(directory, workers=None, shard_size=SHARD_SIZE):
+    """
+    Train a classifier on a corpus, featurizing the gesture files in parallel.
+    :param directory: corpus directory, with one subdirectory per class, or gesture store directory
+    :param workers: number of worker processes, the number of CPUs if not given
+    :param shard_size: number of gestures per task
+    :return: the trained sClassifier
+    """
+    if corpus.is_store(directory):
+        worker, tasks = store_shard_statistics, store_shards(directory, shard_size)
+    else:
+        worker, tasks = shard_statistics, shards(corpus.list_corpus(directory), shard_size)
+    if not tasks:
+        raise Exception("train_corpus: no gestures in {0}".format(directory))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = list(executor.map(worker, tasks))
+    classifier = sc.sClassifier()
+    merge_statistics(classifier, partials)
+    classifier.sDoneAdding()
+    return classifier
+
+
+# Classifier of an evaluation worker process, read once by init_evaluation
+worker_classifier = None
+
+
+def init_evaluation(classifier_file):
+    global worker_classifier
+    worker_classifier = sc.sClassifier()
+    worker_classifier.read(classifier_file)
+
+
+def evaluate_shard(shard):
+    """
+    Worker: classify a shard of gesture files.
+    :param shard: list of (class name, file name)
+    :return: list of (true class name, predicted class name)
+    """
+    features = featurize([corpus.read_gesture(path) for classname, path in shard])
+    classes, ap, dp = worker_classifier.sClassifyBatch(features)
+    return [(shard[i][0], worker_classifier.classdope[classes[i]].name) for i in range(len(shard))]
+
+
+def evaluate_store_shard(task):
+    """
+    Worker: classify a range of gestures of a store.
+    :param task: (store directory, index of the first gesture, index after the last gesture)
+    :return: list of (true class name, predicted class name)
+    """
+    directory, start, stop = task
+    store = corpus.GestureStore(directory)
+    classes, ap, dp = worker_classifier.sClassifyBatch(store.features(start, stop))
+    return [(store.label(start + i), worker_classifier.classdope[classes[i]].name) for i in range(stop - start)]
+
+
+def evaluate_corpus(classifier_file, directory, workers=None, shard_size=SHARD_SIZE):
+    """
+    Evaluate a classifier on a corpus, classifying the gesture files in parallel.
+    :param classifier_file: name of the classifier file, read by every worker
+    :param directory: corpus directory, with one subdirectory per class, or gesture store directory
+    :param workers: number of worker processes, the number of CPUs if not given
+    :param shard_size: number of gestures per task
+    :return: accuracy, dict of (true class name, predicted class name) to count
+    """
+    if corpus.is_store(directory):
+        worker, tasks = evaluate_store_shard, store_shards(directory, shard_size)
+    else:
+        worker, tasks = evaluate_shard, shards(corpus.list_corpus(directory), shard_size)
+    confusion = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_evaluation,
+                             initargs=(classifier_file,)) as executor:
+        for results in executor.map(worker, tasks):
+            for pair in results:
+                confusion[pair] = confusion.get(pair, 0) + 1
+    total = sum(confusion.values())
+    correct = sum(n for (true, predicted), n in confusion.items() if true == predicted)
+    return (correct / total if total else 0.0), confusion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a classifier on a gesture corpus")
+    parser.add_argument("corpus", help="corpus directory, with one subdirectory per class, or gesture store")
+    parser.add_argument("classifier", help="classifier file to write")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--evaluate", default=None, help="corpus directory or gesture store to evaluate on")
+    parser.add_argument("--closest", type=int, default=0, help="print the N most confusable pairs of classes")
+    args = parser.parse_args()
+
+    classifier = train_corpus(args.corpus, args.workers, args.shard_size)
+    classifier.write(args.classifier)
+    print("Wrote classifier with {0} classes to {1}".format(classifier.nclasses, args.classifier))
+    if args.closest > 0:
+        classifier.sDistances(args.closest)
+    if args.evaluate is not None:
+        accuracy, confusion = evaluate_corpus(args.classifier, args.evaluate, args.workers, args.shard_size)
+        print("Accuracy: {0}".format(accuracy))
+        for (true, predicted), n in sorted(confusion.items()):
+            if true != predicted:
+                print("{0} classified as {1}: {2}".format(true, predicted, n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Background recognition for the tkinter front ends: featurization, classification and the shape filters run on a
+worker thread, so the Tk main loop keeps capturing ink at full event rate however long recognition takes.
+
+Jobs are plain functions, run one at a time in the order they were submitted. The worker thread never touches Tk:
+it puts every result on a queue, and the main thread drains that queue with poll(), calling the callbacks there, so
+they are free to touch the canvas. attach() polls from the Tk main loop every POLL_INTERVAL milliseconds:
+
+    recognition = worker.RecognitionWorker()
+    recognition.attach(canvas)
+    y = engine.stroke_features()
+    recognition.submit(lambda: engine.classify_features(y), report)
+
+Backpressure: at most max_pending droppable jobs wait in the queue, submitting one more drops the oldest. Jobs that
+must not be lost, like adding a training example, are submitted with droppable=False and are never dropped.
+Cancellation: cancel() makes every droppable job submitted before it stale, stale jobs are skipped when they come
+up and the results of those already running are not delivered.
+"""
+import queue
+import threading
+import traceback
+from collections import deque
+import instrument
+
+# Largest number of droppable jobs waiting to be run
+MAX_PENDING = 4
+# Milliseconds between two polls of the results from the Tk main loop
+POLL_INTERVAL = 20
+
+
+class Job:
+    """
+    A submitted job with its callback, and the generation it was submitted in if it may be dropped.
+    """
+    __slots__ = ("function", "callback", "droppable", "generation")
+
+    def __init__(self, function, callback, droppable, generation):
+        self.function = function
+        self.callback = callback
+        self.droppable = droppable
+        self.generation = generation
+
+
+class RecognitionWorker:
+    """
+    A thread running recognition jobs in submission order, queueing their results for the main thread.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max(max_pending, 1)
+        self.jobs = deque()
+        # (job, result) of every job that has run and has a callback, drained by poll on the main thread
+        self.results = queue.Queue()
+        self.condition = threading.Condition()
+        # Incremented by cancel(), droppable jobs of an older generation are stale
+        self.generation = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="recognition", daemon=True)
+        self.thread.start()
+
+    def submit(self, function, callback=None, droppable=True):
+        """
+        Queue a job, never blocking the caller.
+        :param function: function() to run on the worker thread
+        :param callback: callback(result) called by poll on the main thread with the result of function, if given
+        :param droppable: whether the job may be dropped under backpressure or cancelled
+        :return: void
+        """
+        with self.condition:
+            if self.closed:
+                raise Exception("submit: the worker is closed")
+            if droppable and sum(job.droppable for job in self.jobs) >= self.max_pending:
+                # Drop the oldest droppable job, its request is the stalest
+                for job in self.jobs:
+                    if job.droppable:
+                        self.jobs.remove(job)
+                        instrument.count("worker_dropped")
+                        break
+            self.jobs.append(Job(function, callback, droppable, self.generation))
+            instrument.observe("worker_queue", len(self.jobs))
+            self.condition.notify()
+
+    def cancel(self):
+        """
+        Make every droppable job submitted so far stale: those still queued are skipped, the results of a running
+        one are not delivered.
+        :return: void
+        """
+        with self.condition:
+            self.generation += 1
+
+    def stale(self, job):
+        return job.droppable and job.generation != self.generation
+
+    def pending(self):
+        """
+        :return: number of jobs waiting to be run
+        """
+        with self.condition:
+            return len(self.jobs)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs and not self.closed:
+                    self.condition.wait()
+                if not self.jobs:
+                    return
+                job = self.jobs.popleft()
+                if self.stale(job):
+                    instrument.count("worker_stale")
+                    continue
+            try:
+                with instrument.stage("worker_job"):
+                    result = job.function()
+            except Exception:
+                # A failing job is reported, the worker keeps running
+                traceback.print_exc()
+                continue
+            if job.callback is not None:
+                self.results.put((job, result))
+
+    def poll(self):
+        """
+        Call the callbacks of the jobs that have run since the last poll, skipping those that became stale. Only to be
+        called from the main thread.
+        :return: number of callbacks called
+        """
+        called = 0
+        while True:
+            try:
+                job, result = self.results.get_nowait()
+            except queue.Empty:
+                return called
+            if self.stale(job):
+                instrument.count("worker_stale")
+                continue
+            job.callback(result)
+            called += 1
+
+    def attach(self, widget, interval=POLL_INTERVAL):
+        """
+        Poll the results from the Tk main loop of a widget, for as long as the worker is not closed.
+        :param widget: Tk widget whose main loop calls the callbacks
+        :param interval: milliseconds between two polls
+        :return: void
+        """
+        def tick():
+            self.poll()
+            if not self.closed:
+                widget.after(interval, tick)
+
+        widget.after(interval, tick)
+
+    def close(self, timeout=1.0):
+        """
+        Stop the worker once the queued jobs have run.
+        :param timeout: longest time to wait for the worker thread, in seconds
+        :return: void
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)